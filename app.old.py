@@ -6,7 +6,7 @@ import random
 import string
 from shiny import App, ui, reactive, render
 from modules.displayr import UploadRawData, runScript, updateData, initializeDeck, deleteDeck
-from modules.g import deleteFile, getByID, newVersionFolder, readSheet, updateByID, uploadDrive, getDriveFile, checkProject, updateLog
+from modules.g import deleteFile, fetch_many, getByID, newVersionFolder, readSheet, updateByID, uploadDrive, getDriveFile, checkProject, updateLog
 from modules.survey import Survey
 from modules.calculate import compare, generateData
 
@@ -168,7 +168,12 @@ def server(input, output, session):
     @reactive.event(input.project_name)
     def _():
         project.set(checkProject(input.project_name()))
-        instrument.set(getDriveFile(project.get(), "instrument"))
+        file = getDriveFile(project.get(), "instrument")
+        # held as bytes, like an uploaded instrument
+        instrument.set(None)
+        if file is not None:
+            with file:
+                instrument.set(file.read())
         if instrument.get() is not None:
             survey.set(Survey.from_docx(instrument.get()))
             alchemer_script.set(survey.get().to_alchemer_script())
@@ -223,18 +228,16 @@ def server(input, output, session):
     @reactive.event(input.createText)
     def _():
         if contact_files.get() is not None:
-            cells = getDriveFile(project.get(), "cell_list")
-            df_cells = pd.read_csv(BytesIO(cells))
+            with getDriveFile(project.get(), "cell_list") as cells:
+                df_cells = pd.read_csv(cells)
             ui.update_slider("text_size", min=1, max=len(df_cells), value=1)
 
     @reactive.Effect
     @reactive.event(input.cutText)
     def _():
         if contact_files.get() is not None:
-            df = getDriveFile(project.get(), "combined_list")
-
-            df_cells = pd.read_csv(
-                BytesIO(df)).drop_duplicates(subset="CellPhone")
+            with getDriveFile(project.get(), "combined_list") as df:
+                df_cells = pd.read_csv(df).drop_duplicates(subset="CellPhone")
 
             age_groups = df_cells["AgeAppend"].value_counts()
             age_groups = age_groups.to_dict()
@@ -415,20 +418,14 @@ def server(input, output, session):
             for file in input.contacts2():
                 files.append(file)
             if len(files) > 0:
-                if len(files) == 1:
-                    file = files[0]
-                    print(file)
-                    file = getDriveFile(project.get(), file)
-
-                    df = pd.read_csv(BytesIO(file))
-                else:
-                    file = getDriveFile(project.get(), files[0])
-                    df = pd.read_csv(BytesIO(file))
-                    for i in range(1, len(files)):
-                        print(files[i])
-                        file = getDriveFile(project.get(), files[i])
-                        df2 = pd.read_csv(BytesIO(file))
-                        df = pd.concat([df, df2])
+                # download the selected lists in parallel
+                lists = fetch_many(
+                    [project.get()["contact_lists"][file] for file in files])
+                frames = []
+                for file in lists.values():
+                    with file:
+                        frames.append(pd.read_csv(file))
+                df = pd.concat(frames)
                 df.rename(columns={
                     "Voters_StateVoterID": "ID",
                     "Voters_FirstName": "FirstName",
@@ -664,11 +661,10 @@ def server(input, output, session):
         # and update the call log with the date, state, and file id
         project = project.get()
         if project["contact_lists"].keys().__contains__("landline_list"):
-            file = getDriveFile(project, "landline_list")
-            df = pd.read_csv(BytesIO(file))
-            scrubLog = getByID("1eYVUbzn7iOaJgwsgg33b5WRR4NOkBzv6")
-            # read json from raw buffer
-            scrubLog = json.loads(scrubLog)
+            with getDriveFile(project, "landline_list") as file:
+                df = pd.read_csv(file)
+            with getByID("1eYVUbzn7iOaJgwsgg33b5WRR4NOkBzv6") as file:
+                scrubLog = json.load(file)
 
             scrubDF = pd.DataFrame()
             if project["name"]+"_LandLines.csv" in scrubLog.keys():
@@ -679,13 +675,13 @@ def server(input, output, session):
             for file in scrubLog:
                 if file["state"] == project["state"]:
                     if file["date"] > datetime.now() - datetime.timedelta(days=30):
-                        file = getByID(file["id"])
-                        df2 = pd.read_csv(BytesIO(file), usecols=["Phone"])
+                        with getByID(file["id"]) as file:
+                            df2 = pd.read_csv(file, usecols=["Phone"])
                         scrubDF = scrubDF.append(df2)
                 elif file["state"] == "US":
                     if file["date"] > datetime.now() - datetime.timedelta(days=30):
-                        file = getByID(file["id"])
-                        df2 = pd.read_csv(BytesIO(file), usecols=["Phone"])
+                        with getByID(file["id"]) as file:
+                            df2 = pd.read_csv(file, usecols=["Phone"])
                         scrubDF = scrubDF.append(df2)
             df = df[~df["Phone"].isin(scrubDF["Phone"])]
 
@@ -726,13 +722,12 @@ def server(input, output, session):
                 # live = project.get()["versions"][input.version()]["live"]
                 contact_list = project.get()["contact_lists"]["combined_list"]
 
-                alchemer = getDriveFile(project.get(), alchemer)
-                broadnet = getDriveFile(project.get(), broadnet)
                 # live = getDriveFile(project.get(), live)
-                contact_list = getDriveFile(project.get(), contact_list)
-
-                data, labels = generateData(alchemer=alchemer, broadnet=broadnet,
-                                            contactlist=contact_list)
+                with getDriveFile(project.get(), alchemer) as alchemer, \
+                        getDriveFile(project.get(), broadnet) as broadnet, \
+                        getDriveFile(project.get(), contact_list) as contact_list:
+                    data, labels = generateData(alchemer=alchemer, broadnet=broadnet,
+                                                contactlist=contact_list)
                 ui.update_slider("data_size", min=1, max=len(data), value=1)
 
                 df.set(data)
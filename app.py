@@ -1,15 +1,17 @@
 from io import BytesIO
 from shiny import App, ui, render, reactive
 from modules.survey import Project
-from modules.g import readSheet
+from modules.g import sales_tracker, flushLogs
 from modules.displayr import initializeDeck
+from modules.metrics import metrics, trace
 import pandas as pd
 
 
 def read_projects():
-    # get the full list of projects with the first row as the column names
-    projects_full = pd.DataFrame(readSheet(
-        name="https://docs.google.com/spreadsheets/d/1sto8qz1SrVpt4AEWTIqV0YCEPYeUQYiJImugHXpZa78", sheet="2023-24 Sales Tracker"))
+    # get the list of projects with the first row as the column names, from
+    # the local snapshot of the tracker columns we need (refreshed in the
+    # background)
+    projects_full = pd.DataFrame(sales_tracker.get())
     projects_full.columns = projects_full.iloc[0]
     projects_full = projects_full[1:].reset_index(
         drop=True).sort_index(ascending=False)
@@ -23,6 +25,7 @@ def read_projects():
 
 
 projects_full = read_projects()
+sales_tracker.start()
 
 
 # navs = ()
@@ -45,6 +48,7 @@ DeckTab = [
     ui.input_file("instrument", label="Upload Instrument",
                   multiple=False, accept=".docx"),
     ui.input_action_button("make_poll", label="Make Poll"),
+    ui.download_button("bundle", label="Download Scripts"),
     ui.output_text_verbatim("out"),
 ]
 
@@ -69,6 +73,21 @@ app_ui = ui.page_fluid(
 def server(input, output, session):
     project: Project = reactive.Value(None)
     list_of_files = reactive.Value([])
+    # write any buffered project logs when the user leaves
+    session.on_ended(flushLogs)
+
+    @reactive.poll(lambda: sales_tracker.version, 10)
+    def projects():
+        return read_projects()
+
+    @reactive.Effect
+    def update_projects():
+        # new projects show up in the dropdown without restarting the app
+        choices = projects()["Project"].tolist()
+        with reactive.isolate():
+            selected = input.selected_project()
+        ui.update_select("selected_project", choices=choices,
+                         selected=selected)
 
     @reactive.Effect
     @reactive.event(input.selected_project)
@@ -96,6 +115,13 @@ def server(input, output, session):
     @reactive.Effect
     @reactive.event(input.make_poll)
     def make_poll():
+        with trace("make_poll") as poll_trace:
+            build_poll()
+        # break the click down by external call
+        for span in metrics.spans(poll_trace):
+            print("%(service)s %(operation)s %(seconds).3fs" % span)
+
+    def build_poll():
         p: Project = project.get()
         df = p.survey.to_dataframe()
         lf = p.survey.to_column_names(as_bytes=True)
@@ -111,6 +137,13 @@ def server(input, output, session):
         initializeDeck(p.name, data=df, colnames=lf,
                        branding="Founders" if "Founders" in p.name else "Coefficient")
 
+    # the scripts, template data and column names as one zip, streamed as
+    # it is written
+    @session.download(filename=lambda: str(project.get()) + ".zip")
+    def bundle():
+        p: Project = project.get()
+        yield from p.get_survey().iter_bundle()
+
     @output
     @render.text()
     def out():
@@ -0,0 +1,352 @@
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+import docx
+import pandas as pd
+import pyreadstat
+from modules import g
+from modules import survey as survey_module
+from modules.calculate import MISSING, answerKey, generateData, readSav, writeSav
+from modules.metrics import metrics
+from modules.survey import Project, Question, QuestionClassifier, QuestionIndex, Survey, classifier, docx_paragraphs
+
+
+def project_open(latency=0.05, versions=[1, 5, 10, 20]):
+    # Opening a project against a local store with simulated network
+    # latency, so the cost of each round-trip shows up without needing Drive
+    # credentials.
+    root = tempfile.mkdtemp(prefix="polls-bench-")
+    backend = g.useLocalStorage(root, latency=latency)
+
+    print("Project open, %dms simulated latency per call" % (latency * 1000))
+    print("%8s %10s %8s" % ("versions", "seconds", "calls"))
+    for n in versions:
+        name = "bench-%02d" % n
+        # Project is chatty, keep its output out of the table
+        with contextlib.redirect_stdout(io.StringIO()):
+            p = Project(name)
+            for _ in range(n):
+                p.new_version()
+            p.sync(None)
+            g.flushLogs()
+
+            # start cold, as a fresh worker would
+            g.setStorage(backend)
+            metrics.reset()
+            start = time.perf_counter()
+            p = Project(name)
+            elapsed = time.perf_counter() - start
+        assert len(p.versions) == n
+        print("%8d %10.3f %8d" % (n, elapsed, len(metrics.spans())))
+
+
+QUESTIONS = [
+    "Do you plan to vote in the upcoming general election?",
+    "If the election for Governor were held today, who would you vote for?",
+    "What is your opinion of Glenn Youngkin?",
+    "Knowing what you know now, who would you vote for?",
+    "How do you plan to vote this year?",
+    "Have you recently seen, read, or heard anything about the race?",
+    "Do you approve or disapprove of the way Joe Biden is doing his job as President?",
+    "Which party do you most align with?",
+    "What is your age?",
+    "Which ideology is most in line with your views?",
+    "Are you male or female?",
+    "What is the highest level of education you have completed so far?",
+    "What is your race?",
+    "Which of the following candidates would you be more likely to vote for?",
+    "Does knowing this make you more or less likely to support them?",
+    "How important is the economy when deciding how to vote for Congress?",
+    "Thinking about the state as a whole, is it headed in the right direction?",
+]
+
+
+def classify_baseline(text):
+    # the old per-paragraph chain: one uncompiled search per rule
+    for pattern, keyword, q_type in QuestionClassifier.RULES:
+        if re.search(pattern, text, flags=re.IGNORECASE):
+            return q_type
+    return "Generic"
+
+
+def question_classifier(paragraphs=[1000, 10000, 100000]):
+    print("Question classification")
+    print("%10s %12s %12s %8s" % ("paragraphs", "regex chain", "classifier", "speedup"))
+    rng = random.Random(0)
+    for n in paragraphs:
+        texts = [rng.choice(QUESTIONS) for _ in range(n)]
+        start = time.perf_counter()
+        expected = [classify_baseline(text) for text in texts]
+        baseline = time.perf_counter() - start
+        start = time.perf_counter()
+        found = [classifier.classify(text)[0] for text in texts]
+        elapsed = time.perf_counter() - start
+        assert found == expected
+        print("%10d %12.4f %12.4f %7.1fx" % (n, baseline, elapsed, baseline / elapsed))
+
+
+def python_docx_paragraphs(file):
+    # the old path: the full python-docx object model, rewriting each
+    # paragraph's runs and adding pPr/numPr where there were none
+    for para in docx.Document(file).paragraphs:
+        para.text = re.sub(" – ", "-", para.text)
+        para.text = re.sub("’", "'", para.text)
+        para.text = re.sub("“", '"', para.text)
+        para.text = re.sub("”", '"', para.text)
+        para.text = re.sub("\n", "", para.text)
+        numPr = para._element.get_or_add_pPr().get_or_add_numPr()
+        if numPr.numId is not None:
+            yield para.text, True, numPr.get_or_add_ilvl().val
+        else:
+            yield para.text, False, 0
+
+
+def instrument(copies):
+    # Resources/Example.docx repeated, ~5 pages per copy
+    doc = docx.Document("Resources/Example.docx")
+    body = doc.element.body
+    original = [e for e in body if not e.tag.endswith("sectPr")]
+    for _ in range(copies - 1):
+        for e in original:
+            body.insert(len(body) - 1, copy.deepcopy(e))
+    fh = io.BytesIO()
+    doc.save(fh)
+    return fh.getvalue()
+
+
+def docx_parser(copies=[1, 20, 50]):
+    print("Instrument parsing")
+    print("%10s %12s %12s %8s" % ("questions", "python-docx", "streaming", "speedup"))
+    for n in copies:
+        content = instrument(n)
+        start = time.perf_counter()
+        expected = Survey.from_paragraphs(python_docx_paragraphs(io.BytesIO(content)))
+        baseline = time.perf_counter() - start
+        start = time.perf_counter()
+        found = Survey.from_paragraphs(docx_paragraphs(io.BytesIO(content)))
+        elapsed = time.perf_counter() - start
+        assert [q.to_dict() for q in found] == [q.to_dict() for q in expected]
+        print("%10d %12.4f %12.4f %7.1fx" % (len(found), baseline, elapsed, baseline / elapsed))
+
+
+def catalogue(surveys):
+    # variations on Example.docx, as if from a back catalogue of polls
+    base = Survey.from_paragraphs(docx_paragraphs("Resources/Example.docx"))
+    rng = random.Random(0)
+    archive = []
+    for i in range(surveys):
+        questions = []
+        for question in base:
+            text = question.question
+            if rng.random() < 0.5:
+                text = text.replace("?", " in district %d?" % i)
+            questions.append(Question(text, question.question_type, list(question.answers),
+                                      question.index, question.sub_type))
+        archive.append(Survey("Poll %d" % i, "DATE", "N", questions))
+    return base, archive
+
+
+def question_matching(surveys=[10, 100, 1000]):
+    print("Matching an instrument against the archive")
+    print("%8s %12s %12s %8s" % ("surveys", "pairwise", "index", "speedup"))
+    for n in surveys:
+        base, archive = catalogue(n)
+        start = time.perf_counter()
+        # the old nested loop over Question.__eq__
+        expected = [[(q, o) for q in base.questions for o in survey.questions if o == q]
+                    for survey in archive]
+        baseline = time.perf_counter() - start
+        start = time.perf_counter()
+        found = [base.match_questions(survey) for survey in archive]
+        elapsed = time.perf_counter() - start
+        # Question.__eq__ is loose, compare identities
+        assert [[(id(q), id(o)) for q, o in pairs] for pairs in found] == \
+            [[(id(q), id(o)) for q, o in pairs] for pairs in expected]
+        print("%8d %12.4f %12.4f %7.1fx" % (n, baseline, elapsed, baseline / elapsed))
+
+    # one index over the whole archive, built once
+    index = QuestionIndex()
+    for survey in archive:
+        index.add_survey(survey, survey.title)
+    start = time.perf_counter()
+    exact = sum(len(index.exact(question)) for question in base)
+    similar = sum(len(index.similar(question)) for question in base)
+    elapsed = time.perf_counter() - start
+    print("%d archived questions: %d exact and %d similar matches in %.4fs" % (
+        len(index), exact, similar, elapsed))
+
+
+def dataframe_baseline(survey):
+    # the old builder: one column at a time, one re.sub per cell per rule
+    df = pd.DataFrame()
+    for question in survey.questions:
+        fill = [""] * (10-len(question.answers))
+        df[question.index] = list(question.answers) + fill
+        df[question.index] = df[question.index].transform(
+            lambda x: re.sub(r" \(random order\)", "", str(x), flags=re.IGNORECASE))
+        match question.question_type:
+            case "Race":
+                df[question.index] = df[question.index].transform(
+                    lambda x: re.sub("african american", "Black", str(x), flags=re.IGNORECASE))
+            case "Ideology":
+                df[question.index] = df[question.index].transform(
+                    lambda x: re.sub("conservative", "Conserv.", str(x), flags=re.IGNORECASE))
+            case "Education":
+                df[question.index] = df[question.index].transform(
+                    lambda x:
+                    "HS" if re.search("high school", str(x), flags=re.IGNORECASE) else "Grad+" if re.search("grad(|uate) degree or higher", str(x), flags=re.IGNORECASE) else str(x))
+            case "Age":
+                df[question.index] = df[question.index].transform(
+                    lambda x: re.sub("65 or older", "65+", str(x), flags=re.IGNORECASE))
+    df["X1"] = df["Gender"]
+    df["X2"] = df["Education"]
+    df["X3"] = df["Ideology"]
+    df["X4"] = df["Age"]
+    df["X5"] = df["Race"]
+    df["X6"] = [1, 2, 3, 4, 0] + [""] * 5
+    if "Party" in df.columns:
+        df["X7"] = df["Party"]
+    else:
+        df["X7"] = [""] * 10
+    df["X8"] = ["DMA1", "DMA2", "DMA3", "DMA4", "DMA5"] + [""] * 5
+    df["X9"] = ["CD1", "CD2", "CD3", "CD4", "CD5"] + [""] * 5
+    return df
+
+
+def template_dataframe(copies=[1, 10, 50]):
+    print("Poll template dataframe")
+    print("%10s %12s %12s %12s %8s" % ("questions", "per column", "vectorized", "memoized", "speedup"))
+    for n in copies:
+        survey = Survey.from_paragraphs(docx_paragraphs(io.BytesIO(instrument(n))))
+        # distinct indices, as a real instrument would have
+        for i, question in enumerate(survey):
+            if i >= 28:
+                question.index = "Q%d" % i
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            expected = dataframe_baseline(survey)
+            baseline = time.perf_counter() - start
+            # nothing memoized from earlier runs
+            survey_module._frames.clear()
+            start = time.perf_counter()
+            found = survey.to_dataframe()
+            elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            survey.to_dataframe()
+            memoized = time.perf_counter() - start
+        pd.testing.assert_frame_equal(found.astype(str), expected.astype(str))
+        print("%10d %12.4f %12.4f %12.4f %7.1fx" % (len(survey), baseline, elapsed, memoized, baseline / elapsed))
+
+
+class DictQuestion:
+    # the old representation: an instance __dict__ and a list of answers
+    def __init__(self, question, question_type, answers, index, sub_type):
+        self.question = question
+        self.question_type = question_type
+        self.answers = answers
+        self.index = index
+        self.sub_type = sub_type
+
+
+def survey_model(surveys=1000):
+    _, archive = catalogue(surveys)
+    questions = sum(map(len, archive))
+    print("Survey model, %d archived surveys (%d questions)" % (surveys, questions))
+    encoded = [json.dumps(survey.to_dict()) for survey in archive]
+    binary = [survey.to_bytes() for survey in archive]
+    compressed = [survey.to_bytes(compress=True) for survey in archive]
+    for name, load in [("dict", lambda: [[DictQuestion(**q) for q in json.loads(data)["questions"]] for data in encoded]),
+                       ("slots", lambda: [Survey.from_bytes(data) for data in binary])]:
+        # memory held by the loaded questions, strings included
+        tracemalloc.start()
+        loaded = load()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("%8s %8.0f bytes/question" % (name, size / questions))
+        del loaded
+
+    for name, data, decode in [("to_dict", encoded, lambda data: Survey.from_dict(json.loads(data))),
+                               ("to_bytes", binary, Survey.from_bytes),
+                               ("zlib", compressed, Survey.from_bytes)]:
+        # best of three, loading is short enough to be noisy
+        elapsed = float("inf")
+        for _ in range(3):
+            start = time.perf_counter()
+            for item in data:
+                decode(item)
+            elapsed = min(elapsed, time.perf_counter() - start)
+        print("%8s %8.3f ms/survey %8d bytes/survey" % (name, elapsed * 1000 / surveys,
+                                                       sum(map(len, data)) / surveys))
+
+
+def spss_export():
+    # The labelled .sav of the example poll, from its real Alchemer and
+    # Broadnet exports, checked against Example.sav (the same responses
+    # written without labels): every answer has to come back as the same
+    # answer, under a code from the questionnaire.
+    with contextlib.redirect_stdout(io.StringIO()):
+        labels, data = generateData(["Resources/Example-SurveyExport.csv", "Resources/Example-response_data.csv"],
+                                    "Resources/Temp.csv")
+        survey = Survey.from_docx(open("Resources/Example.docx", "rb").read())
+    column_labels, answer_labels = survey.to_spss_metadata(labels)
+    data.columns = data.columns.str.replace(" ", "_")
+    path = tempfile.mktemp(suffix=".sav")
+    start = time.perf_counter()
+    writeSav(data, path, column_labels, answer_labels)
+    elapsed = time.perf_counter() - start
+    written, meta = pyreadstat.read_sav(path, apply_value_formats=True)
+    coded, _ = pyreadstat.read_sav(path)
+    expected, _ = pyreadstat.read_sav("Example.sav")
+    print("SPSS export, %d responses, %d of %d columns labelled, %.3fs, %d bytes" % (
+        len(written), len(answer_labels), len(column_labels), elapsed, os.path.getsize(path)))
+    os.remove(path)
+    for column, answers in answer_labels.items():
+        answered = ~expected[column].isin(MISSING)
+        assert (written[column][answered].map(answerKey) == expected[column][answered].map(answerKey)).all(), column
+        assert coded[column].max() <= len(answers), column
+        # SPSS cuts variable labels at 256 bytes
+        assert column_labels[column].startswith(meta.column_names_to_labels[column])
+
+
+def sav_import(copies=[10, 100], chunksize=10000):
+    # Example.sav repeated, as a long archive of past responses
+    data, meta = pyreadstat.read_sav("Example.sav")
+    columns = meta.column_names[:6]
+    print("Importing .sav archives, %d of %d variables" % (len(columns), len(meta.column_names)))
+    print("%8s %12s %12s %12s %12s %12s" % ("rows", "whole", "whole MB", "chunked", "chunked MB", "processes"))
+    for n in copies:
+        path = tempfile.mktemp(suffix=".sav")
+        pyreadstat.write_sav(pd.concat([data] * n, ignore_index=True), path)
+        results = []
+        for read in [lambda: [pd.read_spss(path)[columns]],
+                     lambda: (data for _, data in readSav(path, columns, chunksize)),
+                     lambda: (data for _, data in readSav(path, columns, chunksize * 10, multiprocess=True))]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            # held at once: the whole frame, or one chunk at a time
+            rows = sum(len(chunk) for chunk in read())
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert rows == len(data) * n
+            results += [elapsed, peak / 1024 / 1024]
+        os.remove(path)
+        print("%8d %12.3f %12.1f %12.3f %12.1f %12.3f" % (len(data) * n, *results[:4], results[4]))
+
+
+if __name__ == "__main__":
+    project_open()
+    question_classifier()
+    docx_parser()
+    question_matching()
+    template_dataframe()
+    survey_model()
+    spss_export()
+    sav_import()
@@ -1 +1 @@
-__all__ = ['calculate', 'displayr',  'g', 'survey']
+__all__ = ['cache', 'calculate', 'displayr',  'g', 'index', 'metrics', 'storage', 'survey']
@@ -0,0 +1,153 @@
+import hashlib
+import io
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+CACHE_DIR = ".cache"
+# a .tmp older than this is from a download that died, anything newer may
+# still be being written by another worker process
+STALE_TMP = 60 * 60
+
+
+class BlobCache:
+    # Content-addressed store for Drive downloads. Entries are keyed by the
+    # Drive file ID plus its revision (md5Checksum, or modifiedTime for files
+    # Drive doesn't checksum), so a new revision is simply a different key and
+    # stale blobs age out through the LRU policy instead of being invalidated.
+    # Several worker processes can share the directory, each with its own LRU
+    # index, so a blob may disappear under us when another worker evicts it.
+    def __init__(self, directory: str = os.path.join(CACHE_DIR, "blobs"), max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        # rebuild the LRU order from disk, oldest access first
+        blobs = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                if name.endswith(".tmp"):
+                    if now - stat.st_mtime > STALE_TMP:
+                        os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, name, stat.st_size))
+        for mtime, name, size in sorted(blobs):
+            self._entries[name] = size
+            self._size += size
+
+    @staticmethod
+    def key(driveID: str, revision: str) -> str:
+        return driveID + "-" + re.sub(r"[^\w.-]", "_", revision)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, driveID: str, revision: str):
+        # an open read handle on the cached blob rather than a copy in memory
+        key = self.key(driveID, revision)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                # persist recency so the LRU order survives restarts
+                os.utime(path)
+                blob = open(path, "rb")
+            except FileNotFoundError:
+                # evicted by another worker
+                self._size -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += self._entries[key]
+            return blob
+
+    def reserve(self, driveID: str, revision: str) -> str:
+        # a temporary path to write a blob into before commit(), so
+        # downloads can go straight to disk
+        return self._path(self.key(driveID, revision)) + "." + uuid.uuid4().hex + ".tmp"
+
+    def commit(self, driveID: str, revision: str, tmp: str):
+        key = self.key(driveID, revision)
+        size = os.path.getsize(tmp)
+        if size > self.max_bytes:
+            os.remove(tmp)
+            return
+        with self._lock:
+            # rename so a crash never leaves a truncated blob
+            os.replace(tmp, self._path(key))
+            self._size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+
+    def put(self, driveID: str, revision: str, content: io.BytesIO | str):
+        # content is either an in-memory file or a path on disk, paths are
+        # copied without loading them into memory
+        tmp = self.reserve(driveID, revision)
+        if isinstance(content, str):
+            shutil.copyfile(content, tmp)
+        else:
+            with open(tmp, "wb") as blob, content.getbuffer() as view:
+                blob.write(view)
+        self.commit(driveID, revision, tmp)
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+
+def md5(content: io.BytesIO | str) -> str:
+    # hex digest comparable with Drive's md5Checksum, content is either an
+    # in-memory file or a path on disk
+    digest = hashlib.md5()
+    if isinstance(content, str):
+        with open(content, "rb") as infile:
+            for chunk in iter(lambda: infile.read(1024 * 1024), b""):
+                digest.update(chunk)
+    else:
+        with content.getbuffer() as view:
+            digest.update(view)
+    return digest.hexdigest()
@@ -1,6 +1,7 @@
 from io import BytesIO
 from typing import List
 import pandas as pd
+import pyreadstat
 import re
 
 
@@ -73,6 +74,48 @@ def compare(weight, response):
     return weights
 
 
+# columns of the combined data that aren't answers to a question
+KEY_COLUMNS = ["Date Submitted", "ID"]
+# demographic columns whose answers generateData recodes, see relabel
+RELABELLED = ["Race", "Ideology", "Education", "Age", "Party"]
+
+
+def relabel(column: str, answer) -> str:
+    # an answer as it appears in the combined data
+    answer = str(answer)
+    match column:
+        case "Race":
+            return re.sub("african american", "Black", answer, flags=re.IGNORECASE)
+        case "Ideology":
+            return re.sub("conservative", "Conserv.", answer, flags=re.IGNORECASE)
+        case "Education":
+            answer = re.sub("high school|hs|some college", "HS",
+                            answer, flags=re.IGNORECASE)
+            answer = re.sub("college graduate", "College",
+                            answer, flags=re.IGNORECASE)
+            return re.sub("grad(|uate) degree or higher", "Grad+", answer, flags=re.IGNORECASE)
+        case "Age":
+            return re.sub("65 or older", "65+", answer, flags=re.IGNORECASE)
+        case "Party":
+            answer = re.sub(".+?[^(republican|democrat|independent|other)].+?",
+                            "Other", answer, flags=re.IGNORECASE)
+            answer = re.sub("democrat", "Dem.", answer, flags=re.IGNORECASE)
+            answer = re.sub("republican", "Rep.", answer, flags=re.IGNORECASE)
+            return re.sub("independent", "Ind.", answer, flags=re.IGNORECASE)
+    return answer
+
+
+def questionColumns(labels: pd.DataFrame) -> dict:
+    # {data column: question text} from generateData's labels. Full follows
+    # the exports, with the date first and the ID last, while Generic follows
+    # the data with both keys first, so the question rows are paired in
+    # order rather than row by row.
+    full = [text for text in labels["Full"] if text not in KEY_COLUMNS]
+    generic = [column for column in labels["Generic"]
+               if column not in KEY_COLUMNS]
+    return dict(zip(generic, full))
+
+
 def generateData(data: List[BytesIO], contactlist: BytesIO):
     alchemer = pd.read_csv(data[0])
     broadnet = pd.read_csv(data[1])
@@ -150,32 +193,9 @@ def generateData(data: List[BytesIO], contactlist: BytesIO):
 
             data[column] = pd.concat(
                 [alchemer[column], broadnet[column]], ignore_index=True)
-            match column:
-                case "Race":
-                    data[column] = data[column].transform(
-                        lambda x: re.sub("african american", "Black", str(x), flags=re.IGNORECASE))
-                case "Ideology":
-                    data[column] = data[column].transform(
-                        lambda x: re.sub("conservative", "Conserv.", str(x), flags=re.IGNORECASE))
-                case "Education":
-                    data[column] = data[column].transform(
-                        lambda x: re.sub("high school|hs|some college", "HS", str(x), flags=re.IGNORECASE))
-                    data[column] = data[column].transform(
-                        lambda x: re.sub("college graduate", "College", str(x), flags=re.IGNORECASE))
-                    data[column] = data[column].transform(lambda x: re.sub(
-                        "grad(|uate) degree or higher", "Grad+", str(x), flags=re.IGNORECASE))
-                case "Age":
-                    data[column] = data[column].transform(
-                        lambda x: re.sub("65 or older", "65+", str(x), flags=re.IGNORECASE))
-                case "Party":
-                    data[column] = data[column].transform(
-                        lambda x: re.sub(".+?[^(republican|democrat|independent|other)].+?", "Other", str(x), flags=re.IGNORECASE))
-                    data[column] = data[column].transform(
-                        lambda x: re.sub("democrat", "Dem.", str(x), flags=re.IGNORECASE))
-                    data[column] = data[column].transform(
-                        lambda x: re.sub("republican", "Rep.", str(x), flags=re.IGNORECASE))
-                    data[column] = data[column].transform(
-                        lambda x: re.sub("independent", "Ind.", str(x), flags=re.IGNORECASE))
+            if column in RELABELLED:
+                data[column] = data[column].transform(
+                    lambda x: relabel(column, x))
 
     labels["Generic"] = data.columns
 
@@ -201,6 +221,82 @@ def generateData(data: List[BytesIO], contactlist: BytesIO):
     return labels, data
 
 
+# stand-ins for a missing answer in the combined data
+MISSING = ["", "nan"]
+# what answers are compared on, the exports and the questionnaire can differ
+# in case, spacing and punctuation ("18 – 34" and "18-34")
+ANSWER_KEY = re.compile(r"[^\w]")
+
+
+def answerKey(answer) -> str:
+    return ANSWER_KEY.sub("", str(answer).lower())
+
+
+def encodeCategories(data: pd.DataFrame, answer_labels: dict) -> tuple:
+    # Replace the answer columns with numeric codes and return the SPSS value
+    # labels for them. Codes follow the questionnaire order so they are the
+    # same from one wave to the next, answers that aren't in the
+    # questionnaire get the codes after it. Answers are matched on answerKey
+    # and labelled as in the questionnaire.
+    data = data.copy()
+    value_labels = {}
+    for column, answers in answer_labels.items():
+        if column not in data.columns:
+            continue
+        categories = list(dict.fromkeys(answers))
+        known = {}
+        for label in categories:
+            known.setdefault(answerKey(label), label)
+        values = data[column].astype(object).where(
+            ~data[column].isin(MISSING) & data[column].notna()).map(
+            lambda value: known.get(answerKey(value), str(value)), na_action="ignore")
+        known = set(categories)
+        categories += sorted(str(value) for value in values.dropna().unique()
+                             if value not in known)
+        codes = pd.Categorical(values, categories=categories).codes
+        # -1 is a missing answer
+        data[column] = pd.Series(codes + 1, index=data.index,
+                                 dtype="float32").where(codes >= 0)
+        value_labels[column] = {i + 1: label for i, label in enumerate(categories)}
+    return data, value_labels
+
+
+def writeSav(data: pd.DataFrame, path: str, column_labels: dict = {}, answer_labels: dict = {}, compress: bool = False):
+    # column_labels and answer_labels are by column of the combined data, see
+    # Survey.to_spss_metadata
+    data, value_labels = encodeCategories(data, answer_labels)
+    # columns mixing numbers and text (the ID, numeric in one export and
+    # text in the other) are written as text
+    for column in data.columns:
+        if data[column].dtype == object:
+            data[column] = data[column].map(str, na_action="ignore")
+    labels = {column: column_labels.get(column) for column in data.columns}
+    pyreadstat.write_sav(data, path, column_labels=labels,
+                         variable_value_labels=value_labels, compress=compress)
+
+
+# columns of the combined data that to_spss renamed to be valid SPSS names
+SAV_RENAMES = {"Date_Submitted": "Date Submitted"}
+
+
+def readSav(path: str, columns: List[str] = None, chunksize: int = 100000, multiprocess: bool = False, num_processes: int = 4):
+    # Read an SPSS file `chunksize` rows at a time, split across processes
+    # if multiprocess, and only the variables in `columns` if given. Yields
+    # (labels, data) like generateData, with value labels applied to the
+    # data (as categoricals) and the variable labels as the Full labels.
+    labels = None
+    for data, meta in pyreadstat.read_file_in_chunks(pyreadstat.read_sav, path, chunksize=chunksize, multiprocess=multiprocess,
+                                                     num_processes=num_processes, usecols=columns, apply_value_formats=True):
+        if labels is None:
+            labels = pd.DataFrame()
+            labels["Labels"] = [SAV_RENAMES.get(column, column)
+                                for column in data.columns]
+            labels["Full"] = [meta.column_names_to_labels.get(column) or SAV_RENAMES.get(column, column)
+                              for column in data.columns]
+            labels["Generic"] = labels["Labels"]
+        yield labels, data.rename(columns=SAV_RENAMES)
+
+
 # with open("./22801_230935_va_hd_97_brushfire_poll_9_18_response_data.csv", "rb") as file:
 #     brdnt = BytesIO(file.read())
 
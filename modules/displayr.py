@@ -5,17 +5,51 @@ from pathlib import Path
 import re
 import requests
 import urllib
+from .metrics import span
 
 
 host_name = 'https://app.displayr.com'
 
+def _size(body) -> int:
+    # length of a request body or upload, file objects are measured without
+    # moving their read position
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if isinstance(body, tuple):
+        # requests' (filename, fileobj, ...) form
+        return _size(body[1])
+    if hasattr(body, "seek") and hasattr(body, "tell"):
+        position = body.tell()
+        size = body.seek(0, 2) - position
+        body.seek(position)
+        return size
+    return 0
+
+
+def post(operation, url, **kwargs):
+    # requests.post with latency, bytes (sent and received) and errors
+    # recorded for `operation`
+    with span("displayr", operation) as info:
+        sent = _size(kwargs.get("data")) + sum(
+            _size(f) for f in (kwargs.get("files") or {}).values())
+        response = requests.post(url, **kwargs)
+        info["bytes"] = sent + len(response.content)
+        if response.status_code != 200:
+            info["error"] = "HTTP %d" % response.status_code
+    return response
+
+
 uploaded_file_dictionary = {}
 uploaded_data_files = []
 
 
 def UploadFile(file_path):
     url = "%s/API/Upload" % host_name
-    response = requests.post(url, files={'file': open(file_path, 'rb')})
+    response = post("Upload", url, files={'file': open(file_path, 'rb')})
     upload_id = response.headers['UploadID']
     uploaded_file_dictionary[file_path] = upload_id
     print("File %s uploaded" % file_path)
@@ -26,7 +60,7 @@ def UploadRawFile(file_raw: BytesIO, file_name):
     print(file_raw)
     print(file_raw.getvalue())
     url = "%s/API/Upload" % host_name
-    response = requests.post(url, files={'file': file_raw})
+    response = post("Upload", url, files={'file': file_raw})
     print(response.headers)
     upload_id = response.headers['UploadID']
     uploaded_file_dictionary[file_name] = upload_id
@@ -65,7 +99,7 @@ def UploadQPack(qpack_file_path='../Resources/API_Template.QPack', new_project_n
     url = "%s/API/NewProjectFromQPack?file_name=%s&company=%s&name=%s&upload_id=%s&public_url=false&contact=Fred" % (
         host_name, qpack_file_path,  company_secret, new_project_name, uploaded_file_dictionary[qpack_file_path])
     print(url)
-    response = requests.post(url)
+    response = post("NewProjectFromQPack", url)
     print("\n"*3)
     print(response)
     print("\n"*3)
@@ -92,7 +126,7 @@ def updateData(project_secret):
             'path'], 'upload_id': file_info['upload_id'], 'new_serial': 1, 'abort': 'Never'}
         url = "%s/API/ImportUpdatedData?%s" % (host_name,
                                                urllib.parse.urlencode(params))
-        response = requests.post(url)
+        response = post("ImportUpdatedData", url)
         if response.status_code != 200:
             print("Problem using data file %s" % file_info['path'])
         # file = open(file_info['path']+".html",
@@ -106,7 +140,7 @@ def runScript(secret, script):
     print('Running script...')
     url = "%s/API/RunScript?project=%s&abort=OnWarning" % (
         host_name, secret)
-    response = requests.post(url, data=script)
+    response = post("RunScript", url, data=script)
     if response.status_code != 200:
         print("Problem running script")
     if ('Success' in str(response.content)):
@@ -132,8 +166,8 @@ def dataRefresh(log, data, colnames, xnames):
         # append functions to qscript
         qscript += "methodology_page();"
         runScript(project_secret, qscript)
-    response = requests.post(
-        "%s/API/PublishProject?project=%s&view_mode_access=L" % (host_name, project_secret), data=qscript)
+    response = post(
+        "PublishProject", "%s/API/PublishProject?project=%s&view_mode_access=L" % (host_name, project_secret), data=qscript)
     if response.status_code != 200:
         print("Problem publishing project")
         return "Problem publishing project"
@@ -168,8 +202,8 @@ def initializeDeck(input, data: BytesIO, colnames, xnames=None, branding="Standa
         qscript += "top_lines_to_pages();"
         qscript += "questions_to_pages(questions);"
         runScript(project_secret, qscript)
-    response = requests.post(
-        "%s/API/PublishProject?project=%s&view_mode_access=L" % (host_name, project_secret), data=qscript)
+    response = post(
+        "PublishProject", "%s/API/PublishProject?project=%s&view_mode_access=L" % (host_name, project_secret), data=qscript)
     if response.status_code != 200:
         print("Problem publishing project")
         return "Problem publishing project"
@@ -181,8 +215,8 @@ def initializeDeck(input, data: BytesIO, colnames, xnames=None, branding="Standa
 
 
 def deleteDeck(secret):
-    response = requests.post(
-        "%s/API/DeleteProject?project=%s" % (host_name, secret))
+    response = post(
+        "DeleteProject", "%s/API/DeleteProject?project=%s" % (host_name, secret))
     if response.status_code != 200:
         print("Problem deleting project")
         return "Problem deleting project"
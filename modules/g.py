@@ -1,74 +1,646 @@
 from __future__ import print_function
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import copy
 from datetime import datetime
 import json
 import os
+import random
+import socket
+import threading
+import time
 from typing import Any, Literal
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload, MediaIoBaseUpload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest, MediaFileUpload, MediaIoBaseDownload, MediaIoBaseUpload
 import gspread
+import httplib2
+import requests
 import io
+import pandas as pd
+from .cache import CACHE_DIR, BlobCache, md5
+from .index import FILE_FIELDS, DriveIndex
+from .metrics import metrics, span
+from .storage import LocalStorage, Storage
 
 
 def readSheet(name="https://docs.google.com/spreadsheets/d/1sto8qz1SrVpt4AEWTIqV0YCEPYeUQYiJImugHXpZa78", sheet="2023-24 Sales Tracker"):
-    gc = gspread.authorize(credentials)
-    sh = gc.open_by_url(name)
-    worksheet = sh.worksheet(sheet)
-    data = worksheet.get_all_values()
+    sh = call(gc.open_by_url, name)
+    worksheet = call(sh.worksheet, sheet)
+    data = call(worksheet.get_all_values)
     return data
 
 
+def readColumns(columns: list, name="https://docs.google.com/spreadsheets/d/1sto8qz1SrVpt4AEWTIqV0YCEPYeUQYiJImugHXpZa78", sheet="2023-24 Sales Tracker"):
+    # Like readSheet but only fetches the named columns, the header row is
+    # read first and the columns are then fetched in one batch read
+    sh = call(gc.open_by_url, name)
+    worksheet = call(sh.worksheet, sheet)
+    header = call(worksheet.row_values, 1)
+    ranges = []
+    for column in columns:
+        letter = gspread.utils.rowcol_to_a1(1, header.index(column) + 1)[:-1]
+        ranges.append("%s2:%s" % (letter, letter))
+    values = call(worksheet.batch_get, ranges)
+    # batch_get drops trailing empty cells, pad the columns back out
+    length = max([len(value) for value in values] + [0])
+    cells = [[row[0] if row else "" for row in value] + [""] * (length - len(value))
+             for value in values]
+    return [list(columns)] + [list(row) for row in zip(*cells)]
+
+
+class SheetSnapshot:
+    # Columns of a sheet saved locally so the app can start from the last
+    # snapshot immediately, then refreshed in a background thread every `ttl`
+    # seconds. `version` changes whenever the data does.
+    def __init__(self, path: str, columns: list, ttl: float = 300, **sheet):
+        self.path = path
+        self.columns = columns
+        self.ttl = ttl
+        self.sheet = sheet
+        self.version = 0
+        self._rows = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def get(self) -> list:
+        if self._rows is None:
+            try:
+                with open(self.path) as infile:
+                    saved = json.load(infile)
+                if saved.get("columns") == self.columns:
+                    self._rows = saved["rows"]
+            except (FileNotFoundError, ValueError):
+                pass
+        if self._rows is None:
+            self.refresh()
+        return self._rows
+
+    def refresh(self):
+        rows = readColumns(self.columns, **self.sheet)
+        with self._lock:
+            if rows != self._rows:
+                self._rows = rows
+                self.version += 1
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "w") as outfile:
+                    json.dump({"columns": self.columns,
+                              "rows": rows}, outfile)
+
+    def start(self):
+        # refresh straight away (the snapshot may be old) and then every ttl
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print("failed to refresh " + self.path + ": " + str(e))
+                time.sleep(self.ttl)
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+
+class Lazy:
+    # Stands in for a client that is expensive to build (credentials file,
+    # discovery documents, gspread auth) and builds it on first use, so
+    # importing this module doesn't touch the network. With per_thread each
+    # thread gets its own instance, for clients that aren't thread-safe.
+    def __init__(self, factory, per_thread: bool = False):
+        self._factory = factory
+        self._value = None
+        self._local = threading.local() if per_thread else None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._local is not None:
+            if getattr(self._local, "value", None) is None:
+                self._local.value = self._factory()
+            return self._local.value
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
 SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
     'https://www.googleapis.com/auth/drive'
 ]
-credentials = service_account.Credentials.from_service_account_file(
-    'Resources/Credentials.json', scopes=SCOPES)
-spreadsheet_service = build('sheets', 'v4', credentials=credentials)
-service = build('drive', 'v3', credentials=credentials)
+credentials = Lazy(lambda: service_account.Credentials.from_service_account_file(
+    'Resources/Credentials.json', scopes=SCOPES))
+spreadsheet_service = Lazy(lambda: build(
+    'sheets', 'v4', credentials=credentials.get(), cache_discovery=False))
+# googleapiclient/httplib2 clients aren't thread-safe, so every thread
+# builds its own authorized client from the bundled discovery document
+service = Lazy(lambda: build('drive', 'v3',
+               credentials=credentials.get(), cache_discovery=False), per_thread=True)
+
+gc = Lazy(lambda: gspread.authorize(credentials.get()))
+
+class Throttle:
+    # Concurrency limit shared by every Drive and Sheets call, adjusted AIMD
+    # style: each success raises the limit by 1/limit and each throttled
+    # response halves it, so parallel work settles just under the quota.
+    def __init__(self, limit: float = 8, minimum: float = 1, maximum: float = 32):
+        self.limit = limit
+        self.minimum = minimum
+        self.maximum = maximum
+        self.active = 0
+        self.throttled = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *args):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def success(self):
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def backoff(self):
+        with self._condition:
+            self.throttled += 1
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+throttle = Throttle()
+
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 32
+RATE_LIMIT_REASONS = ["userRateLimitExceeded",
+                      "rateLimitExceeded", "sharingRateLimitExceeded"]
+# dropped connections and timeouts, as raised by httplib2 (Drive) and
+# requests (gspread) as well as the builtins
+CONNECTION_ERRORS = (ConnectionError, TimeoutError, socket.gaierror, httplib2.ServerNotFoundError,
+                     requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+# calls that may have gone through before a 5xx or a dropped connection, so
+# resending them could create a duplicate file or folder
+NON_IDEMPOTENT = ["drive.files.create", "drive.batch"]
+
+
+def _status(e: Exception) -> int | None:
+    if isinstance(e, HttpError):
+        return e.resp.status
+    if isinstance(e, gspread.exceptions.APIError):
+        return e.response.status_code
+    return None
+
+
+def _throttled(e: Exception) -> bool:
+    status = _status(e)
+    if status == 429:
+        return True
+    if status == 403:
+        content = e.content if isinstance(e, HttpError) else e.response.content
+        return any(reason.encode() in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+
+def _retryable(e: Exception) -> bool:
+    status = _status(e)
+    if status is None:
+        return isinstance(e, CONNECTION_ERRORS)
+    return _throttled(e) or status >= 500
+
+
+def _operation(fn) -> tuple:
+    # (service, operation) labels for the metrics of a call
+    owner = getattr(fn, "__self__", None)
+    if owner is not None and hasattr(owner, "methodId"):
+        return "drive", owner.methodId
+    if isinstance(owner, MediaIoBaseDownload):
+        return "drive", "drive.files.get_media"
+    if isinstance(owner, BatchHttpRequest):
+        return "drive", "drive.batch"
+    return "sheets", "sheets." + fn.__name__
+
+
+def _idempotent(fn) -> bool:
+    # the chunks of a resumable upload are safe to resend, that's what the
+    # session is for, it's the single request creates that aren't
+    return fn.__name__ != "execute" or _operation(fn)[1] not in NON_IDEMPOTENT
+
+
+def call(fn, *args, **kwargs):
+    # Run one Drive/Sheets call inside the shared throttle, retrying quota
+    # errors, 429s, 5xxs and dropped connections with full-jitter
+    # exponential backoff. Creates are only retried when they were rate
+    # limited, which means they were rejected.
+    retryable = _retryable if _idempotent(fn) else _throttled
+    with span(*_operation(fn)) as info:
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                with throttle:
+                    result = fn(*args, **kwargs)
+                throttle.success()
+                return result
+            except Exception as e:
+                if attempt == MAX_RETRIES or not retryable(e):
+                    raise
+                if _throttled(e):
+                    throttle.backoff()
+                info["retries"] += 1
+                delay = random.uniform(
+                    0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                print("retrying after %s (%.1fs)" % (type(e).__name__, delay))
+                time.sleep(delay)
+
+
+def execute(request):
+    return call(request.execute)
 
-gc = gspread.authorize(credentials)
 
 Polls_Auto = '0AKBlRMpdmXBkUk9PVA'
 Archive = '107MbfDHw6wpkWaRWF5gDDzyQLC7dbArS'
 Logs = "1yB4a93Jen7g1Dzw_VWR2x07_SJN6Qrji"
 ScrubLog = "1eYVUbzn7iOaJgwsgg33b5WRR4NOkBzv6"
 
+# the poll projects from the sales tracker, see app.read_projects
+sales_tracker = SheetSnapshot(os.path.join(CACHE_DIR, "sales_tracker.json"), [
+                              "Product", "Project Number", "Project Description"])
+
+# downloaded file contents, reused across sessions until the Drive revision changes
+blob_cache = BlobCache()
+
+# local copy of the Polls_Auto folder tree, used for listings and name lookups
+drive_index = DriveIndex(os.path.join(
+    CACHE_DIR, "drive_index.sqlite"), Polls_Auto, service, execute)
+
+
+# Uploads are sent as resumable sessions in chunks of this size (a multiple of
+# 256KB), so a dropped connection only resends the current chunk and files
+# on disk are streamed rather than read into memory
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def media(content: io.BytesIO | str, mimetype: str):
+    # content is either an in-memory file or a path on disk, anything that
+    # fits in one chunk is sent in a single request rather than a session
+    if isinstance(content, str):
+        resumable = os.path.getsize(content) > UPLOAD_CHUNK_SIZE
+        return MediaFileUpload(content, mimetype=mimetype, resumable=resumable, chunksize=UPLOAD_CHUNK_SIZE)
+    resumable = content.getbuffer().nbytes > UPLOAD_CHUNK_SIZE
+    return MediaIoBaseUpload(content, mimetype=mimetype, resumable=resumable, chunksize=UPLOAD_CHUNK_SIZE)
+
+
+def upload(request, progress=None) -> dict:
+    # drive a resumable create/update request to completion one chunk at a
+    # time, progress is called with the fraction uploaded so far
+    if not request.resumable:
+        # a single multipart request, the body holds the whole payload
+        response = execute(request)
+        metrics.transferred("drive", request.methodId, len(request.body))
+        if progress is not None:
+            progress(1.0)
+        return response
+    response = None
+    while response is None:
+        status, response = call(request.next_chunk)
+        if status is not None and progress is not None:
+            progress(status.progress())
+    metrics.transferred("drive", request.methodId, request.resumable.size())
+    if progress is not None:
+        progress(1.0)
+    return response
+
+
+# Downloads are requested in chunks of this size and written straight to
+# their destination, so a large file is never held in memory more than once
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def download(driveID, fh, progress=None):
+    # fh is any writable file object, it is rewound and returned when done
+    return storage.download(driveID, fh, progress)
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class DownloadStream(io.RawIOBase):
+    # Readable end of a download to `path` running in a background thread, so
+    # a reader (e.g. pd.read_csv with chunksize) can start parsing before the
+    # download finishes. The reader follows the file as it grows instead of
+    # taking chunks from a queue: the download holds a throttle slot while it
+    # runs and must never wait on a slow or abandoned reader. Closing the
+    # stream before the download is done cancels it and removes the file.
+    def __init__(self, driveID, path):
+        self.path = path
+        self.complete = False
+        self.cancelled = False
+        self._done = False
+        self._error = None
+        self._written = 0
+        self._condition = threading.Condition()
+        self._out = open(path, "wb")
+        self._in = open(path, "rb")
+        # run under the caller's context so the download's spans land in
+        # the caller's trace
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run, args=(self._run, driveID), daemon=True)
+        self._thread.start()
+
+    def _run(self, driveID):
+        error = None
+        try:
+            download(driveID, self._Writer(self))
+        except Exception as e:
+            error = e
+        finally:
+            self._out.close()
+        with self._condition:
+            self._done = True
+            self._error = error
+            self.complete = error is None and not self.cancelled
+            if self.cancelled:
+                os.remove(self.path)
+            self._condition.notify_all()
+
+    class _Writer(io.RawIOBase):
+        def __init__(self, stream):
+            self.stream = stream
+
+        def writable(self):
+            return True
+
+        def seekable(self):
+            return False
+
+        def write(self, b):
+            stream = self.stream
+            if stream.cancelled:
+                raise DownloadCancelled(stream.path)
+            n = stream._out.write(b)
+            stream._out.flush()
+            with stream._condition:
+                stream._written += n
+                stream._condition.notify_all()
+            return n
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        with self._condition:
+            while self._in.tell() >= self._written and not self._done:
+                self._condition.wait()
+            available = self._written - self._in.tell()
+            if not available and self._error is not None:
+                raise self._error
+        return self._in.readinto(memoryview(b)[:available])
+
+    def wait(self):
+        # until the download has finished, whether or not it was all read
+        self._thread.join()
+
+    def close(self):
+        if self.closed:
+            return
+        with self._condition:
+            self.cancelled = True
+            if self._done and not self.complete and os.path.exists(self.path):
+                os.remove(self.path)
+        self._in.close()
+        super().close()
+
+
+def iterCSV(driveID, chunksize: int = 100000, **kwargs):
+    # yield DataFrame chunks of a csv on Drive while it is still downloading,
+    # the download is saved to the blob cache as it goes
+    revision = revisionOf(getMetadata(driveID))
+    cached = blob_cache.get(driveID, revision)
+    if cached is not None:
+        with cached:
+            yield from pd.read_csv(cached, chunksize=chunksize, **kwargs)
+        return
+    tmp = blob_cache.reserve(driveID, revision)
+    stream = DownloadStream(driveID, tmp)
+    reader = io.BufferedReader(stream, buffer_size=DOWNLOAD_CHUNK_SIZE)
+    try:
+        yield from pd.read_csv(reader, chunksize=chunksize, **kwargs)
+        # the parser may stop short of the end, let the rest land so the
+        # cached copy is whole
+        stream.wait()
+    finally:
+        # stopping early (break, an exception, close()) cancels the download
+        reader.close()
+    if stream.complete:
+        blob_cache.commit(driveID, revision, tmp)
+
+
+def getMetadata(driveID) -> dict:
+    # metadata-only request, cheap compared to downloading the media
+    return storage.metadata(driveID)
+
+
+def revisionOf(metadata: dict) -> str:
+    # Google Docs formats have no md5Checksum so fall back to modifiedTime
+    return metadata.get('md5Checksum', metadata.get('modifiedTime', ''))
+
 
 def getFolder():
-    page_token = None
-    while True:
-        results = service.files().list(
-            pageSize=10, fields="nextPageToken, files(id, name)", supportsAllDrives=True, includeItemsFromAllDrives=True, corpora='drive', driveId=Polls_Auto, pageToken=page_token).execute()
-        years = results.get('files', [])
-        if not years:
-            print('No files found.')
-        found = False
-        for year in years:
-            if year['name'] == datetime.now().strftime("%Y"):
-                return year['id']
-        page_token = results.get('nextPageToken', None)
-        if page_token is None:
-            break
-    if not found:
+    year = storage.find(datetime.now().strftime("%Y"), Polls_Auto)
+    if year is not None:
+        return year
+    return Folder._createFolder(datetime.now().strftime("%Y"), Polls_Auto)
+
+
+class DriveStorage(Storage):
+    # The Polls_Auto shared drive, through the Drive API
+    name = "drive"
+
+    def metadata(self, file_id: str) -> dict:
+        return execute(service.files().get(fileId=file_id, fields='id, name, mimeType, md5Checksum, modifiedTime, size',
+                                           supportsAllDrives=True))
+
+    def download(self, file_id: str, fh, progress=None):
+        request = service.files().get_media(
+            fileId=file_id, supportsAllDrives=True)
+        downloader = MediaIoBaseDownload(
+            fh, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+        done = False
+        while done is False:
+            status, done = call(downloader.next_chunk)
+            if progress is not None:
+                progress(status.progress())
+        metrics.transferred("drive", "drive.files.get_media",
+                            status.resumable_progress)
+        if fh.seekable():
+            fh.seek(0)
+        return fh
+
+    def create_folder(self, name: str, parent: str) -> str:
         directory_metadata = {
-            'name': datetime.now().strftime("%Y"),
+            'name': name,
             'mimeType': 'application/vnd.google-apps.folder',
-            'parents': [Polls_Auto]
+            'parents': [parent]
         }
-        base = service.files().create(body=directory_metadata,
-                                      fields='id, name', supportsAllDrives=True).execute()
+        base = execute(service.files().create(body=directory_metadata,
+                                              fields='id, name', supportsAllDrives=True))
+        drive_index.add({**base, 'parents': [parent],
+                        'mimeType': 'application/vnd.google-apps.folder'})
         return base['id']
 
+    def create_folders(self, names: list, parent: str) -> list:
+        # Sibling folders don't depend on each other, so create them all in
+        # one Drive batch request (one round-trip) and return their ids in order
+        if len(names) == 1:
+            return [self.create_folder(names[0], parent)]
+        ids = [None] * len(names)
+        errors = {}
+
+        def created(request_id, response, exception):
+            if exception is not None:
+                errors[int(request_id)] = exception
+            else:
+                ids[int(request_id)] = response['id']
+                drive_index.add({**response, 'parents': [parent],
+                                'mimeType': 'application/vnd.google-apps.folder'})
+
+        pending = list(range(len(names)))
+        for attempt in range(MAX_RETRIES + 1):
+            errors.clear()
+            batch = service.new_batch_http_request(callback=created)
+            for i in pending:
+                batch.add(service.files().create(body={'name': names[i], 'mimeType': 'application/vnd.google-apps.folder',
+                                                       'parents': [parent]}, fields='id, name', supportsAllDrives=True), request_id=str(i))
+            call(batch.execute)
+            # only the requests that were throttled inside the batch are
+            # resent, any other failure may still have created the folder
+            pending = [i for i, e in errors.items() if _throttled(e)]
+            if len(pending) < len(errors) or (pending and attempt == MAX_RETRIES):
+                raise next(iter(errors.values()))
+            if not pending:
+                return ids
+            if any(_throttled(e) for e in errors.values()):
+                throttle.backoff()
+            time.sleep(random.uniform(
+                0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+        return ids
+
+    def create_file(self, name: str, parent: str, content, mimetype: str = None, progress=None) -> dict:
+        file = upload(service.files().create(body={'name': name, 'parents': [parent]},
+                                                                fields='id, name, md5Checksum, modifiedTime, size', media_body=media(content, mimetype), supportsAllDrives=True), progress)
+        drive_index.add({**file, 'parents': [parent], 'mimeType': mimetype})
+        return file
+
+    # moves, renames and deletes go straight into drive_index like creates,
+    # find() trusts its hits so a stale entry would resolve to the wrong file
+    # until the next poll
+    def update_file(self, file_id: str, name: str, content=None, mimetype: str = None, progress=None) -> dict:
+        if content is None:
+            file = execute(service.files().update(fileId=file_id, body={'name': name},
+                                                  fields=FILE_FIELDS, supportsAllDrives=True))
+        else:
+            file = upload(service.files().update(fileId=file_id, body={'name': name},
+                                                 fields=FILE_FIELDS, supportsAllDrives=True, media_body=media(content, mimetype)), progress)
+        drive_index.add(file)
+        return file
+
+    def move(self, file_id: str, parent: str, previous: str):
+        drive_index.add(execute(service.files().update(fileId=file_id, addParents=parent, removeParents=previous,
+                                                       fields=FILE_FIELDS, supportsAllDrives=True)))
+
+    def delete(self, file_id: str):
+        execute(service.files().delete(
+            fileId=file_id, supportsAllDrives=True))
+        drive_index.remove(file_id)
+
+    def children(self, parent: str) -> list:
+        return drive_index.children(parent)
+
+    def find(self, name: str, parent: str) -> str | None:
+        return drive_index.find(name, parent)
 
-Current_Folder = getFolder()
+
+# Where Folder, File and the logs are stored, the shared drive unless
+# setStorage/useLocalStorage swapped it (e.g. to run the pipeline offline)
+storage: Storage = DriveStorage()
+
+
+def setStorage(backend: Storage):
+    global storage, Project_Logs
+    flushLogs()
+    storage = backend
+    # ids resolved against the previous backend mean nothing in this one
+    Project_Logs = None
+    log_shards.clear()
+    current_folder.clear()
+    log_snapshot.clear()
+
+
+def useLocalStorage(root: str, latency: float = 0, bandwidth: float = None) -> LocalStorage:
+    backend = LocalStorage(root, latency, bandwidth)
+    # the hardcoded ids this module expects to exist
+    backend.ensure(Polls_Auto, "Polls_Auto")
+    backend.ensure(Archive, "Archive", Polls_Auto)
+    backend.ensure(Logs, "log.json", Polls_Auto, b"{}")
+    setStorage(backend)
+    return backend
+
+
+def createFolders(names: list, parent) -> list:
+    return storage.create_folders(names, parent)
+
+
+CURRENT_FOLDER_FILE = os.path.join(CACHE_DIR, "current_folder.json")
+current_folder = {}
+
+
+def currentFolder() -> str:
+    # This year's folder in Polls_Auto, resolved on first use and saved
+    # locally so later worker starts don't have to list the drive again
+    year = datetime.now().strftime("%Y")
+    if current_folder.get("year") != year:
+        try:
+            with open(CURRENT_FOLDER_FILE) as infile:
+                saved = json.load(infile)
+        except (FileNotFoundError, ValueError):
+            saved = {}
+        if saved.get("year") != year or saved.get("storage") != storage.name:
+            saved = {"year": year, "storage": storage.name, "id": getFolder()}
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(CURRENT_FOLDER_FILE, "w") as outfile:
+                json.dump(saved, outfile)
+        current_folder.update(saved)
+    return current_folder["id"]
+
+
+def __getattr__(name):
+    # Current_Folder used to be resolved at import, keep it importable
+    if name == "Current_Folder":
+        return currentFolder()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 class Folder:
-    def __init__(self, name: str, driveID: str = None, parent=Current_Folder):
+    def __init__(self, name: str, driveID: str = None, parent=None):
         self.name = name
         self.parent = parent
         if driveID is None:
+            if parent is None:
+                self.parent = parent = currentFolder()
             self.driveID = self._createFolder(name, parent)
         else:
             self.driveID = driveID
@@ -88,26 +660,23 @@ class Folder:
 
     @classmethod
     def from_dict(cls, d):
-        return Folder(name=d["name"], driveID=d["driveID"], parent=d["parent"])
+        # pure deserialization, the folder already exists on Drive
+        return cls(name=d["name"], driveID=d["driveID"], parent=d.get("parent"))
 
-    def _createFolder(self, name, parent):
-        directory_metadata = {
-            'name': name,
-            'mimeType': 'application/vnd.google-apps.folder',
-            'parents': [parent]
-        }
-        base = service.files().create(body=directory_metadata,
-                                      fields='id, name', supportsAllDrives=True).execute()
-        return base['id']
+    @classmethod
+    def create_many(cls, names: list, parent) -> list:
+        return [cls(name, driveID=driveID, parent=parent) for name, driveID in zip(names, createFolders(names, parent))]
+
+    @staticmethod
+    def _createFolder(name, parent):
+        return storage.create_folder(name, parent)
 
     def delete(self):
-        service.files().delete(
-            fileId=self.driveID, supportsAllDrives=True).execute()
+        storage.delete(self.driveID)
         return None
 
     def update(self, name):
-        service.files().update(fileId=self.driveID, body={'name': name},
-                               fields='id, name', supportsAllDrives=True).execute()
+        storage.update_file(self.driveID, name)
         self.name = name
         return None
 
@@ -115,23 +684,11 @@ class Folder:
         return self.driveID
 
     def get_children(self):
-        children = []
-        page_token = None
-        while True:
-            results = service.files().list(
-                pageSize=10, fields="nextPageToken, files(id, name)", supportsAllDrives=True, includeItemsFromAllDrives=True, corpora='drive', driveId=self.driveID, pageToken=page_token).execute()
-            files = results.get('files', [])
-            if not files:
-                print('No files found.')
-            for file in files:
-                children.append(file)
-            page_token = results.get('nextPageToken', None)
-            if page_token is None:
-                break
-
+        children = storage.children(self.driveID)
+        if not children:
+            print('No files found.')
         for child in children:
             child["parent"] = self.driveID
-            child = File.from_dict(child)
         return children
 
     def upload_file(self, file: dict | io.BytesIO):
@@ -146,8 +703,9 @@ class Folder:
 
 
 class File:
-    def __init__(self, name, driveID=None, content=None, parent=Current_Folder, mimetype: Literal["csv", "sav", "docx", "xlsx"] = None):
+    def __init__(self, name, driveID=None, content=None, parent=None, mimetype: Literal["csv", "sav", "docx", "xlsx"] = None, path: str = None, progress=None):
         self.name = name
+        self.progress = progress
         match mimetype:
             case "csv":
                 self.mimetype = "text/csv"
@@ -162,25 +720,43 @@ class File:
                     self.mimetype = "application/octet-stream"
                 elif name.endswith(".docx"):
                     self.mimetype = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                self.mimetype = None
+                else:
+                    self.mimetype = "application/octet-stream"
 
+        # a file on disk is streamed from its path and read back through the
+        # cache when needed instead of being held in memory
+        source = path if path is not None else content
         if driveID is None:
-            if content is None:
+            if source is None:
                 raise TypeError("Must provide either driveID or content")
+            if parent is None:
+                parent = currentFolder()
+            # a new file is uploaded once, by the create itself
             self.driveID = self._createFile(
-                name, content, parent, self.mimetype)
+                name, source, parent, self.mimetype, progress)
         else:
             self.driveID = driveID
+            if source is not None:
+                self._updateByID(self.driveID, source, self.mimetype)
         self.content = content
-        if content is not None:
-            self.update(content)
+        # whether content is a handle we opened (and so ours to close)
+        self._opened = False
         self.parent = parent
 
     def __call__(self, *args: Any, **kwds: Any) -> Any:
-        if self.content is None:
-            self.content = self._getByID(self.driveID)
+        if self.content is None or self.content.closed:
+            self._setContent(self._getByID(self.driveID))
+        self.content.seek(0)
         return self.content
 
+    def _setContent(self, content):
+        # close the handle this replaces rather than leave it to the garbage
+        # collector, content passed in by the caller is left alone
+        if self._opened and self.content is not None:
+            self.content.close()
+        self.content = content
+        self._opened = True
+
     def __dict__(self):
         return {
             "name": self.name,
@@ -192,50 +768,60 @@ class File:
         return self.__dict__()
 
     @classmethod
-    def from_dict(self, d):
-        print(d)
-        d["mimetype"] = d["name"].split(".")[-1]
+    def from_dict(cls, d):
+        mimetype = d["name"].split(".")[-1]
         if "driveID" in d.keys():
-            print("driveID")
-            return File(name=d["name"], driveID=d["driveID"], content=None, parent=d["parent"], mimetype=d["mimetype"])
+            # hydrating from the log, no network calls until the content is needed
+            return cls(name=d["name"], driveID=d["driveID"], content=None, parent=d.get("parent"), mimetype=mimetype)
         elif "datapath" in d.keys():
-            with open(d["datapath"], "rb") as in_file:
-                in_file = io.BytesIO(in_file.read())
-                replace = d["to_replace"] if "to_replace" in d.keys() else None
-                return File(name=d["name"], driveID=replace, content=in_file, parent=d["parent"], mimetype=d["mimetype"])
+            replace = d["to_replace"] if "to_replace" in d.keys() else None
+            return cls(name=d["name"], driveID=replace, path=d["datapath"], parent=d["parent"], mimetype=mimetype, progress=d.get("progress"))
         else:
             return NotImplementedError
 
     @classmethod
-    def _createFile(cls, name, content, parent, mimetype="text/csv"):
-        media = MediaIoBaseUpload(
-            content, mimetype=mimetype)
-        file = service.files().create(body={'name': name, 'parents': [parent]},
-                                      fields='id, name', media_body=media, supportsAllDrives=True).execute()
+    def _createFile(cls, name, content, parent, mimetype="text/csv", progress=None):
+        file = storage.create_file(name, parent, content, mimetype, progress)
+        # we already have the content, seed the cache so the next read is free
+        blob_cache.put(file['id'], revisionOf(file), content)
         return file['id']
 
     @classmethod
     def _getByID(cls, driveID):
-        file = service.files().get_media(
-            fileId=driveID, supportsAllDrives=True)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, file)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        file = fh.getvalue()
-        return io.BytesIO(file)
+        # returns a read handle on the downloaded file, which is spooled to
+        # the blob cache on disk rather than copied around in memory
+        revision = revisionOf(getMetadata(driveID))
+        cached = blob_cache.get(driveID, revision)
+        if cached is not None:
+            return cached
+        tmp = blob_cache.reserve(driveID, revision)
+        try:
+            with open(tmp, "wb") as fh:
+                download(driveID, fh)
+            # the open handle stays valid after commit renames (or drops) the file
+            file = open(tmp, "rb")
+            blob_cache.commit(driveID, revision, tmp)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return file
 
     def _updateByID(self, driveID, content, mimetype="text/csv"):
-        media = MediaIoBaseUpload(
-            content, mimetype=mimetype)
-        service.files().update(fileId=driveID, body={'name': self.name},
-                               fields='id, name', supportsAllDrives=True, media_body=media).execute()
+        # skip the transfer entirely when Drive already has these bytes
+        remote = getMetadata(driveID)
+        if remote.get('md5Checksum') == md5(content):
+            print(self.name + " is unchanged, skipping upload")
+            if self.name != remote.get('name'):
+                storage.update_file(driveID, self.name)
+            return None
+        file = storage.update_file(
+            driveID, self.name, content, mimetype, self.progress)
+        blob_cache.put(driveID, revisionOf(file), content)
         return None
 
     def delete(self):
-        service.files().delete(
-            fileId=self.driveID, supportsAllDrives=True).execute()
+        storage.delete(self.driveID)
         return None
 
     def update(self, content):
@@ -244,9 +830,12 @@ class File:
         return None
 
     def get(self):
-        self.content = self._getByID(self.driveID)
+        self._setContent(self._getByID(self.driveID))
         return self.content
 
+    def iter_csv(self, chunksize: int = 100000, **kwargs):
+        return iterCSV(self.driveID, chunksize, **kwargs)
+
     def __dict__(self):
         return {
             "name": self.name,
@@ -255,68 +844,211 @@ class File:
         }
 
 
-def init_project(name, logs) -> dict:
-    directory_metadata = {
-        'name': name,
-        'mimeType': 'application/vnd.google-apps.folder',
-        'parents': [Current_Folder]
-    }
-    base = service.files().create(body=directory_metadata,
-                                  fields='id, name', supportsAllDrives=True).execute()
-    cl = service.files().create(body={'name': 'Contact Lists', 'mimeType': 'application/vnd.google-apps.folder',
-                                      'parents': [base['id']]}, fields='id, name', supportsAllDrives=True).execute()
+FETCH_WORKERS = 4
+
+
+def fetch_many(file_ids: list, max_workers: int = FETCH_WORKERS) -> dict:
+    # download several files concurrently, each worker thread uses its own
+    # Drive client, returns a read handle per id in the order given, the
+    # caller closes them
+    file_ids = list(dict.fromkeys(file_ids))
+    if len(file_ids) <= 1:
+        return {file_id: File._getByID(file_id) for file_id in file_ids}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(file_ids))) as pool:
+        # a context can only be entered by one thread at a time, so each
+        # download gets its own copy of the caller's (and its trace)
+        futures = [pool.submit(contextvars.copy_context().run, File._getByID, file_id)
+                   for file_id in file_ids]
+        return {file_id: future.result() for file_id, future in zip(file_ids, futures)}
+
+
+def init_project(name, logs=None) -> dict:
+    base = storage.create_folder(name, currentFolder())
+    cl = storage.create_folder('Contact Lists', base)
     project_log = {
         'name': name,
-        'folder': base['id'],
+        'folder': base,
         'contact_lists': {
-            'folder': cl['id'],
+            'folder': cl,
         },
         'versions': {
 
         },
         'instrument': '',
     }
-    logs[name] = project_log
     updateLog(project_log, logs)
     return project_log
 
 
 def checkProject(name) -> dict:
-    # Download log.json from Polls_Auto shared drive
-    # Hardcode log id for speed so we don't have to scan the whole folder
-    # Drive API scans from newest to oldest so this will always be last
-    # because it is updated every time a new poll is created it will grow to be very large
-    # so we will need to archive it every so often
-    file = service.files().get_media(
-        fileId=Logs, supportsAllDrives=True)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, file)
-    done = False
-    while done is False:
-        status, done = downloader.next_chunk()
-    logs = fh.getvalue().decode('utf-8')
-    logs = json.loads(logs)
-    if name in logs.keys():
+    log = getLog(name)
+    if log is not None:
         print("found existing project")
-        return logs[name]
+        return log
     else:
         print("creating new project")
         print(name)
-        return init_project(name, logs)
+        return init_project(name)
+
+
+# Each project's log lives in its own <name>.json shard inside the Project Logs
+# folder, so a sync only rewrites the project that changed and reading one
+# project only downloads that project. log.json is the old monolithic log, it
+# is still read for projects that haven't been written since the switch and
+# each of those is moved into a shard the first time it is read.
+Project_Logs = None
+log_shards = {}
+
+
+def getLogFolder() -> str:
+    global Project_Logs
+    if Project_Logs is None:
+        Project_Logs = storage.find('Project Logs', Polls_Auto)
+        if Project_Logs is None:
+            Project_Logs = Folder._createFolder('Project Logs', Polls_Auto)
+    return Project_Logs
+
+
+def _findShard(name) -> str | None:
+    if name not in log_shards:
+        shard = storage.find(name + ".json", getLogFolder())
+        if shard is None:
+            return None
+        log_shards[name] = shard
+    return log_shards[name]
+
+
+class LogSnapshot:
+    # Parsed log files kept in memory. A read within max_age seconds of the
+    # last check is served straight from memory, after that the revision is
+    # checked with a metadata-only request and the file is only downloaded
+    # again if it actually changed on Drive.
+    def __init__(self, max_age: float = 5.0):
+        self.max_age = max_age
+        self.fresh = 0
+        self.revalidated = 0
+        self.downloads = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def read(self, driveID) -> dict:
+        with self._lock:
+            entry = self._entries.get(driveID)
+        if entry is not None and time.monotonic() - entry["checked"] < self.max_age:
+            self.fresh += 1
+            return copy.deepcopy(entry["data"])
+        checked = time.monotonic()
+        revision = revisionOf(getMetadata(driveID))
+        if entry is not None and entry["revision"] == revision:
+            self.revalidated += 1
+            data = entry["data"]
+        else:
+            self.downloads += 1
+            data = json.load(download(driveID, io.BytesIO()))
+        with self._lock:
+            self._entries[driveID] = {
+                "revision": revision, "checked": checked, "data": data}
+        return copy.deepcopy(data)
+
+    def wrote(self, driveID, metadata: dict, data: dict):
+        # our own writes return the new revision, so there's no need to
+        # download what we just uploaded
+        with self._lock:
+            self._entries[driveID] = {"revision": revisionOf(metadata), "checked": time.monotonic(),
+                                      "data": copy.deepcopy(data)}
+
+    def forget(self, driveID):
+        with self._lock:
+            self._entries.pop(driveID, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "fresh": self.fresh,
+            "revalidated": self.revalidated,
+            "downloads": self.downloads,
+            "entries": len(self._entries),
+        }
 
 
-def archiveLog():
-    # Download log.json from Polls_Auto shared drive
-    # Copy contents to date stamped file in Polls_Auto/Archive
-    # Remove contents from log.json but make sure not to delete the file
-    # so that we can continue to use it with it's hardcoded id
-    log = getLogs()
+log_snapshot = LogSnapshot()
+
+
+def _writeShard(update):
+    name = update["name"]
+    content = io.BytesIO(json.dumps(update).encode('utf-8'))
+    shard = _findShard(name)
+    if shard is None:
+        file = storage.create_file(
+            name + '.json', getLogFolder(), content, 'text/json')
+        log_shards[name] = file['id']
+    else:
+        file = storage.update_file(
+            shard, name + '.json', content, 'text/json')
+    log_snapshot.wrote(file['id'], file, update)
+
+
+def _readShard(shard) -> dict:
+    return log_snapshot.read(shard)
+
+
+def _getLegacyLogs() -> dict:
+    # log.json in the Polls_Auto shared drive, id is hardcoded for speed so we
+    # don't have to scan the whole folder
+    return log_snapshot.read(Logs)
+
+
+def _setLegacyLogs(logs: dict):
+    file = storage.update_file(Logs, 'log.json', io.BytesIO(
+        json.dumps(logs).encode('utf-8')), 'text/json')
+    log_snapshot.wrote(Logs, file, logs)
+
+
+def getLog(name) -> dict | None:
+    # updates still waiting in the write buffer are the newest version
+    pending = sync_buffer.get(name)
+    if pending is not None:
+        return pending
+    shard = _findShard(name)
+    if shard is not None:
+        return _readShard(shard)
+    legacy = _getLegacyLogs()
+    if name in legacy.keys():
+        print("moving " + name + " out of log.json")
+        _writeShard(legacy[name])
+        return legacy[name]
+    return None
 
-    # set contents of archive log to current log
-    archive_log = log
 
-    # set current log to empty
-    log = {}
+def migrateLogs():
+    # shard every project still in log.json, then empty it so getLog stops
+    # falling back to the monolithic download
+    flushLogs()
+    legacy = _getLegacyLogs()
+    for name, log in legacy.items():
+        if _findShard(name) is None:
+            _writeShard(log)
+    _setLegacyLogs({})
+    return list(legacy.keys())
+
+
+def _listShards() -> dict:
+    shards = {}
+    for file in storage.children(getLogFolder()):
+        if file['name'].endswith('.json'):
+            shards[file['name'][:-len('.json')]] = file['id']
+    log_shards.update(shards)
+    return shards
+
+
+def archiveLog():
+    # Copy every project log to a date stamped file in Polls_Auto/Archive
+    # then empty log.json (without deleting it, so it keeps its hardcoded id)
+    # and move the project shards into the archive folder
+    archive_log = getLogs()
 
     # create dated log in archive folder
     date = datetime.now().strftime("%Y-%m-%d")
@@ -324,98 +1056,137 @@ def archiveLog():
     with open(date+'-log.json', 'w') as outfile:
         json.dump(archive_log, outfile)
 
-    media = MediaFileUpload(
-        date+'-log.json')
-
-    file_metadata = {
-        'name': date+'-log.json',
-        'parents': [Archive]
-    }
-
-    file = service.files().create(body=file_metadata, media_body=media,
-                                  fields='id, name', supportsAllDrives=True).execute()
+    storage.create_file(date+'-log.json', Archive,
+                        date+'-log.json', 'application/json')
     os.remove(date+'-log.json')
 
-    # update log.json
-    with open('log.json', 'w') as outfile:
-        json.dump(log, outfile)
+    _setLegacyLogs({})
+    for name, shard in _listShards().items():
+        storage.move(shard, Archive, getLogFolder())
+        log_snapshot.forget(shard)
+    log_shards.clear()
+    return {}
 
-    media = MediaFileUpload(
-        'log.json')
 
-    file_metadata = {
-        'name': 'log.json',
-    }
+def getLogs() -> dict:
+    # Full view of every project, this downloads every shard so only use it
+    # for whole-log operations like archiving, use getLog for a single project
+    flushLogs()
+    logs = _getLegacyLogs()
+    for name, shard in _listShards().items():
+        logs[name] = _readShard(shard)
+    return logs
+
 
-    file = service.files().update(fileId=Logs, body=file_metadata,
-                                  fields='id, name', supportsAllDrives=True, media_body=media).execute()
+class SyncBuffer:
+    # Write-behind buffer for project logs. Updates to the same project are
+    # coalesced and written once the project has been quiet for `quiet`
+    # seconds (or `max_wait` after its first pending update at the latest).
+    def __init__(self, quiet: float = 2.0, max_wait: float = 10.0):
+        self.quiet = quiet
+        self.max_wait = max_wait
+        self.requested = 0
+        self.written = 0
+        self._pending = {}
+        self._writing = {}
+        self._first = None
+        self._deadline = None
+        self._lock = threading.Lock()
+        # wakes the flusher when the deadline moves
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        # held for a whole flush, so flushLogs() returns only once writes
+        # already taken by the flusher thread have landed too
+        self._flushing = threading.Lock()
+
+    def add(self, update):
+        with self._lock:
+            self._pending[update["name"]] = copy.deepcopy(update)
+            self.requested += 1
+            now = time.monotonic()
+            if self._first is None:
+                self._first = now
+            self._deadline = min(now + self.quiet, self._first + self.max_wait)
+            if self._thread is None:
+                # one long-lived flusher rather than a thread per update, so
+                # every flush goes through the same thread's Drive client and
+                # connection
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._deadline is None or self._deadline > time.monotonic():
+                    self._wake.wait(None if self._deadline is None
+                                    else self._deadline - time.monotonic())
+            self.flush()
+
+    def get(self, name) -> dict | None:
+        with self._lock:
+            # an update taken by a flush still counts until it has landed
+            update = self._pending.get(name, self._writing.get(name))
+            return copy.deepcopy(update) if update is not None else None
+
+    def flush(self):
+        with self._flushing:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._writing = pending
+                self._first = None
+                self._deadline = None
+            for name, update in pending.items():
+                print("updating project " + name)
+                try:
+                    _writeShard(update)
+                    self.written += 1
+                except Exception as e:
+                    print("failed to write log for " + name + ": " + str(e))
+                    # keep it for the next flush unless a newer update arrived
+                    with self._lock:
+                        self._pending.setdefault(name, update)
+            with self._lock:
+                self._writing = {}
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "requested": self.requested,
+            "written": self.written,
+            "pending": pending,
+            "coalesced": self.requested - self.written - pending,
+        }
 
-    # delete local log.json
-    os.remove('log.json')
-    return log
 
+sync_buffer = SyncBuffer()
 
-def getLogs() -> dict:
-    # Download log.json from Polls_Auto shared drive
-    # Hardcode log id for speed so we don't have to scan the whole folder
-    # Drive API scans from newest to oldest so this will always be last
-    # because it is updated every time a new poll is created it will grow to be very large
-    # so we will need to archive it every so often
-    file = service.files().get_media(
-        fileId=Logs, supportsAllDrives=True)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, file)
-    done = False
-    while done is False:
-        status, done = downloader.next_chunk()
-    logs = fh.getvalue().decode('utf-8')
-    logs = json.loads(logs)
-    return logs
 
+def flushLogs():
+    sync_buffer.flush()
 
-def updateLog(update, logs=getLogs()):
-    logs[update["name"]] = update
-    print("updating project " + update["name"])
 
-    logs_bytes = json.dumps(logs).encode('utf-8')
-    media = MediaIoBaseUpload(io.BytesIO(logs_bytes), mimetype='text/json')
+# don't lose buffered updates when the worker shuts down
+atexit.register(flushLogs)
 
-    file_metadata = {
-        'name': 'log.json'
-    }
 
-    file = service.files().update(fileId=Logs, body=file_metadata,
-                                  fields='id, name', supportsAllDrives=True, media_body=media).execute()
+def updateLog(update, logs=None, flush=False):
+    if logs is not None:
+        logs[update["name"]] = update
+    sync_buffer.add(update)
+    if flush:
+        flushLogs()
 
 
 def getDriveFile(log, file_type):
+    # a read handle like getByID, or None
     if log.keys().__contains__(file_type) and log[file_type] != "":
-        file = service.files().get_media(
-            fileId=log[file_type], supportsAllDrives=True)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, file)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        file = fh.getvalue()
+        file = getByID(log[file_type])
     elif log["versions"].keys().__contains__(file_type):
-        file = service.files().get_media(
-            fileId=log["versions"][file_type]["folder"], supportsAllDrives=True)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, file)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        file = fh.getvalue()
+        file = getByID(log["versions"][file_type]["folder"])
     elif log["contact_lists"].keys().__contains__(file_type):
-        file = service.files().get_media(
-            fileId=log["contact_lists"][file_type], supportsAllDrives=True)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, file)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        file = fh.getvalue()
+        file = getByID(log["contact_lists"][file_type])
     else:
         print("File not found")
         file = None
@@ -427,17 +1198,14 @@ def newVersionFolder(log):
     version_number = "V"+str(len(versions.keys())+1).zfill(2) + \
         " "+datetime.now().strftime("%m.%d")
 
-    version = service.files().create(body={'name': version_number, 'mimeType': 'application/vnd.google-apps.folder',
-                                           'parents': [log['folder']]}, fields='id, name', supportsAllDrives=True).execute()
-    supporting_documents = service.files().create(body={'name': "Supporting Documents", 'mimeType': 'application/vnd.google-apps.folder',
-                                                        'parents': [version['id']]}, fields='id, name', supportsAllDrives=True).execute()
-    input_files = service.files().create(body={'name': "Input Files", 'mimeType': 'application/vnd.google-apps.folder',
-                                               'parents': [version['id']]}, fields='id, name', supportsAllDrives=True).execute()
+    version = storage.create_folder(version_number, log['folder'])
+    supporting_documents, input_files = createFolders(
+        ["Supporting Documents", "Input Files"], version)
 
     log["versions"][version_number] = {
-        "folder": version['id'],
+        "folder": version,
         "supporting_documents": {
-            "folder": supporting_documents['id'],
+            "folder": supporting_documents,
             "weights": "",
             "output_data": "",
             "column_names": "",
@@ -445,7 +1213,7 @@ def newVersionFolder(log):
 
         },
         "input_files": {
-            "folder": input_files['id'],
+            "folder": input_files,
             "alchemer_output": "",
             "broadnet_output": "",
             "live_call_output": "",
@@ -471,7 +1239,7 @@ def checkVersion(log):
         return name
 
 
-def uploadDrive(log, file, file_type, version=""):
+def uploadDrive(log, file, file_type, version="", progress=None):
     folder = log
     mime_type = "text/csv"
     check = file_type
@@ -526,19 +1294,20 @@ def uploadDrive(log, file, file_type, version=""):
             folder = log
 
     if check in folder.keys() and folder[check] != "":
-        print("Updating "+file_type)
-        media = MediaFileUpload(
-            file['datapath'], mimetype=mime_type)
-        service.files().update(fileId=folder[file_type if file_type != 'raw_data' else file['name']], body={'name': file['name']},
-                               fields='id, name', supportsAllDrives=True, media_body=media).execute()
+        file_id = folder[file_type if file_type !=
+                         'raw_data' else file['name']]
+        if getMetadata(file_id).get('md5Checksum') == md5(file['datapath']):
+            print(file_type + " is unchanged, skipping upload")
+        else:
+            print("Updating "+file_type)
+            storage.update_file(
+                file_id, file['name'], file['datapath'], mime_type, progress)
 
         updateLog(log)
     else:
         print("Uploading "+file_type)
-        media = MediaFileUpload(
-            file['datapath'], mimetype=mime_type)
-        file = service.files().create(body={'name': file['name'], 'parents': [folder['folder']]},
-                                      fields='id, name', supportsAllDrives=True, media_body=media).execute()
+        file = storage.create_file(
+            file['name'], folder['folder'], file['datapath'], mime_type, progress)
         folder[file_type] = file['id']
         match file_type:
             case "raw_data":
@@ -649,28 +1418,19 @@ def uploadDrive(log, file, file_type, version=""):
 
 
 def getByID(file_id):
-    file = service.files().get_media(
-        fileId=file_id, supportsAllDrives=True)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, file)
-    done = False
-    while done is False:
-        status, done = downloader.next_chunk()
-    file = fh.getvalue()
-    return file
+    # a read handle on the file spooled to the blob cache, close it when done
+    return File._getByID(file_id)
 
 
-def updateByID(file_id, file):
-    media = MediaFileUpload(
-        file)
-    service.files().update(fileId=file_id, body={'name': file['name']},
-                           fields='id, name', supportsAllDrives=True, media_body=media).execute()
+def updateByID(file_id, file, progress=None):
+    # mimetype is guessed from the path
+    storage.update_file(file_id, file['name'],
+                        file['datapath'], None, progress)
     return None
 
 
 def deleteByID(file_id):
-    service.files().delete(
-        fileId=file_id, supportsAllDrives=True).execute()
+    storage.delete(file_id)
     return None
 
 
@@ -678,18 +1438,15 @@ def deleteFile(log, file_type, version=""):
     if log.keys().__contains__(file_type) and log[file_type] != "":
         log[file_type] = ""
         updateLog(log)
-        service.files().delete(
-            fileId=log[file_type], supportsAllDrives=True).execute()
+        storage.delete(log[file_type])
     elif log["versions"].keys().__contains__(file_type):
         log["versions"][file_type] = ""
         updateLog(log)
-        service.files().delete(
-            fileId=log["versions"][version][file_type], supportsAllDrives=True).execute()
+        storage.delete(log["versions"][version][file_type])
     elif log["contact_lists"].keys().__contains__(file_type):
         file = log["contact_lists"][file_type]
         log["contact_lists"].pop(file_type)
         updateLog(log)
-        service.files().delete(
-            fileId=log["contact_lists"][file], supportsAllDrives=True).execute()
+        storage.delete(log["contact_lists"][file])
 
     return None
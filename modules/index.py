@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+FILE_FIELDS = "id, name, parents, mimeType, md5Checksum, modifiedTime, size, trashed"
+
+
+class DriveIndex:
+    # Local SQLite copy of the folder/file tree of a shared drive. It is
+    # bootstrapped once with a full listing (large pages, only the fields we
+    # use) and then kept current by polling the Drive changes feed from a
+    # saved page token, so listing a folder or resolving a name to an id is
+    # a local query. `service` and `execute` are the Drive client and request
+    # executor from modules.g.
+    def __init__(self, path: str, drive_id: str, service, execute, poll_interval: float = 15.0):
+        self.path = path
+        self.drive_id = drive_id
+        self.service = service
+        self.execute = execute
+        self.poll_interval = poll_interval
+        self._polled = 0
+        self._db = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS files (
+                id TEXT PRIMARY KEY, name TEXT, parent TEXT, mimeType TEXT,
+                md5Checksum TEXT, modifiedTime TEXT, size INTEGER)""")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS files_parent_name ON files (parent, name)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.commit()
+        return self._db
+
+    def _token(self) -> str | None:
+        row = self._connect().execute(
+            "SELECT value FROM meta WHERE key = 'page_token'").fetchone()
+        return row[0] if row else None
+
+    def _setToken(self, token: str):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('page_token', ?)", (token,))
+
+    def _upsert(self, file: dict):
+        if file.get("trashed"):
+            self._remove(file["id"])
+            return
+        parents = file.get("parents") or [None]
+        self._connect().execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", (
+            file["id"], file["name"], parents[0], file.get("mimeType"), file.get("md5Checksum"), file.get("modifiedTime"), file.get("size")))
+
+    def _remove(self, file_id: str):
+        self._connect().execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def bootstrap(self):
+        with self._lock:
+            # take the token before listing so nothing changed during the
+            # listing is missed, replaying a change twice is harmless
+            token = self.execute(self.service.changes().getStartPageToken(
+                driveId=self.drive_id, supportsAllDrives=True))["startPageToken"]
+            files = []
+            page_token = None
+            while True:
+                results = self.execute(self.service.files().list(
+                    q="trashed = false", pageSize=1000, fields="nextPageToken, files(%s)" % FILE_FIELDS,
+                    supportsAllDrives=True, includeItemsFromAllDrives=True, corpora='drive', driveId=self.drive_id, pageToken=page_token))
+                files += results.get("files", [])
+                page_token = results.get("nextPageToken", None)
+                if page_token is None:
+                    break
+            # every page is fetched before writing, other workers share the
+            # database and mustn't wait on Drive for its write lock
+            db = self._connect()
+            with db:
+                db.execute("DELETE FROM files")
+                for file in files:
+                    self._upsert(file)
+                self._setToken(token)
+            self._polled = time.monotonic()
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            token = self._token()
+            if token is None:
+                self.bootstrap()
+                return
+            if not force and time.monotonic() - self._polled < self.poll_interval:
+                return
+            changes = []
+            while True:
+                results = self.execute(self.service.changes().list(
+                    pageToken=token, driveId=self.drive_id, pageSize=1000, supportsAllDrives=True, includeItemsFromAllDrives=True,
+                    fields="nextPageToken, newStartPageToken, changes(changeType, fileId, removed, file(%s))" % FILE_FIELDS))
+                changes += results.get("changes", [])
+                if "newStartPageToken" in results:
+                    token = results["newStartPageToken"]
+                    break
+                token = results.get("nextPageToken")
+                if token is None:
+                    break
+            db = self._connect()
+            with db:
+                for change in changes:
+                    # drive-level changes (the shared drive itself) have no file
+                    if change.get("changeType", "file") != "file" or change.get("fileId") is None:
+                        continue
+                    if change.get("removed") or "file" not in change:
+                        self._remove(change["fileId"])
+                    else:
+                        self._upsert(change["file"])
+                if token is not None:
+                    self._setToken(token)
+            self._polled = time.monotonic()
+
+    def children(self, parent: str) -> list:
+        self.refresh()
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id, name, mimeType FROM files WHERE parent = ? ORDER BY name", (parent,)).fetchall()
+        return [{"id": id, "name": name, "mimeType": mimeType} for id, name, mimeType in rows]
+
+    def find(self, name: str, parent: str) -> str | None:
+        # a miss is confirmed against the changes feed before it is trusted,
+        # the file may have been created since the last poll
+        for force in (False, True):
+            self.refresh(force)
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT id FROM files WHERE parent = ? AND name = ?", (parent, name)).fetchone()
+            if row:
+                return row[0]
+        return None
+
+    def add(self, file: dict):
+        # record our own creates, moves and renames straight away rather than
+        # waiting for the next poll of the changes feed
+        with self._lock:
+            self._upsert(file)
+            self._connect().commit()
+
+    def remove(self, file_id: str):
+        # our own deletes, with everything under a deleted folder
+        with self._lock:
+            self._connect().execute("""DELETE FROM files WHERE id IN (
+                WITH RECURSIVE tree(id) AS (
+                    SELECT ? UNION SELECT files.id FROM files JOIN tree ON files.parent = tree.id)
+                SELECT id FROM tree)""", (file_id,))
+            self._connect().commit()
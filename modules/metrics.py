@@ -0,0 +1,134 @@
+import contextvars
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+
+# latency histogram buckets, in seconds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Metrics:
+    # Latency histograms and byte/retry/error counters for every external
+    # call (Drive, Sheets, Displayr), labelled by service and operation, plus
+    # a ring buffer of recent spans so a slow request can be broken down hop
+    # by hop.
+    def __init__(self, max_spans: int = 2000):
+        self._histograms = {}
+        self._bytes = {}
+        self._retries = {}
+        self._errors = {}
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def record(self, service: str, operation: str, seconds: float, bytes: int = 0, retries: int = 0, error: str = None):
+        labels = (service, operation)
+        with self._lock:
+            histogram = self._histograms.setdefault(
+                labels, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+            self._bytes[labels] = self._bytes.get(labels, 0) + bytes
+            self._retries[labels] = self._retries.get(labels, 0) + retries
+            if error is not None:
+                self._errors[labels] = self._errors.get(labels, 0) + 1
+            self._spans.append({
+                "trace": current_trace.get(),
+                "service": service,
+                "operation": operation,
+                "start": time.time() - seconds,
+                "seconds": seconds,
+                "bytes": bytes,
+                "retries": retries,
+                "error": error,
+            })
+
+    def transferred(self, service: str, operation: str, bytes: int):
+        # bytes moved outside of a span, e.g. by a chunked upload/download
+        with self._lock:
+            labels = (service, operation)
+            self._bytes[labels] = self._bytes.get(labels, 0) + bytes
+
+    def spans(self, trace: str = None) -> list:
+        with self._lock:
+            return [span for span in self._spans if trace is None or span["trace"] == trace]
+
+    def prometheus(self) -> str:
+        def labels(service, operation, **extra):
+            pairs = [("service", service), ("operation", operation)] + list(extra.items())
+            return "{" + ",".join('%s="%s"' % (k, v) for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            lines.append(
+                "# HELP external_call_seconds Latency of calls to external services")
+            lines.append("# TYPE external_call_seconds histogram")
+            for (service, operation), histogram in sorted(self._histograms.items()):
+                for bound, count in zip(BUCKETS, histogram["buckets"]):
+                    lines.append("external_call_seconds_bucket%s %d" % (
+                        labels(service, operation, le=bound), count))
+                lines.append("external_call_seconds_bucket%s %d" % (
+                    labels(service, operation, le="+Inf"), histogram["count"]))
+                lines.append("external_call_seconds_sum%s %f" % (
+                    labels(service, operation), histogram["sum"]))
+                lines.append("external_call_seconds_count%s %d" % (
+                    labels(service, operation), histogram["count"]))
+            for name, help, counter in [("external_call_bytes_total", "Bytes transferred", self._bytes),
+                                        ("external_call_retries_total",
+                                         "Retried attempts", self._retries),
+                                        ("external_call_errors_total", "Calls that failed", self._errors)]:
+                lines.append("# HELP %s %s" % (name, help))
+                lines.append("# TYPE %s counter" % name)
+                for (service, operation), value in sorted(counter.items()):
+                    lines.append("%s%s %d" %
+                                 (name, labels(service, operation), value))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._bytes.clear()
+            self._retries.clear()
+            self._errors.clear()
+            self._spans.clear()
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(service: str, operation: str):
+    # time one external call, the caller can fill in bytes and retries on the
+    # yielded dict
+    info = {"bytes": 0, "retries": 0}
+    start = time.perf_counter()
+    error = None
+    try:
+        yield info
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        metrics.record(service, operation, time.perf_counter() - start,
+                       info["bytes"], info["retries"], info.get("error", error))
+
+
+@contextmanager
+def trace(name: str):
+    # group every span recorded inside the block under one id, e.g.
+    # everything behind one "Make Poll" click. The id lives in a contextvar,
+    # so it follows the block onto fetch_many workers and DownloadStream
+    # threads (which copy the caller's context) but not onto the SyncBuffer
+    # flusher, whose writes coalesce updates from many traces.
+    token = current_trace.set(name + "-" + uuid.uuid4().hex[:8])
+    try:
+        yield current_trace.get()
+    finally:
+        current_trace.reset(token)
@@ -0,0 +1,213 @@
+import io
+import json
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from .cache import md5
+from .metrics import span
+
+
+FOLDER = "application/vnd.google-apps.folder"
+
+
+class Storage(ABC):
+    # What modules.g needs from a file store. Files and folders are addressed
+    # by id, metadata dicts use the Drive field names (id, name, mimeType,
+    # md5Checksum, modifiedTime, size) and content is either an in-memory
+    # file or a path on disk.
+    name = "storage"
+
+    @abstractmethod
+    def metadata(self, file_id: str) -> dict:
+        ...
+
+    @abstractmethod
+    def download(self, file_id: str, fh, progress=None):
+        ...
+
+    @abstractmethod
+    def create_folder(self, name: str, parent: str) -> str:
+        ...
+
+    def create_folders(self, names: list, parent: str) -> list:
+        return [self.create_folder(name, parent) for name in names]
+
+    @abstractmethod
+    def create_file(self, name: str, parent: str, content, mimetype: str = None, progress=None) -> dict:
+        ...
+
+    @abstractmethod
+    def update_file(self, file_id: str, name: str, content=None, mimetype: str = None, progress=None) -> dict:
+        ...
+
+    @abstractmethod
+    def move(self, file_id: str, parent: str, previous: str):
+        ...
+
+    @abstractmethod
+    def delete(self, file_id: str):
+        ...
+
+    @abstractmethod
+    def children(self, parent: str) -> list:
+        ...
+
+    @abstractmethod
+    def find(self, name: str, parent: str) -> str | None:
+        ...
+
+
+class LocalStorage(Storage):
+    # Storage in a local directory, for running the whole Project flow
+    # offline. `latency` (seconds per call) and `bandwidth` (bytes per
+    # second) simulate the network so our own overhead can be measured
+    # separately from transfer time. Every call is recorded under the
+    # "local" service in modules.metrics.
+    def __init__(self, root: str, latency: float = 0, bandwidth: float = None):
+        self.root = root
+        self.name = "local:" + os.path.abspath(root)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        os.makedirs(os.path.join(root, "meta"), exist_ok=True)
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+
+    def _wait(self, size: int = 0):
+        delay = self.latency
+        if self.bandwidth:
+            delay += size / self.bandwidth
+        if delay:
+            time.sleep(delay)
+
+    def _meta_path(self, file_id: str) -> str:
+        return os.path.join(self.root, "meta", file_id + ".json")
+
+    def _blob_path(self, file_id: str) -> str:
+        return os.path.join(self.root, "blobs", file_id)
+
+    def _read(self, file_id: str) -> dict:
+        try:
+            with open(self._meta_path(file_id)) as infile:
+                return json.load(infile)
+        except FileNotFoundError:
+            raise FileNotFoundError("File not found: " + file_id)
+
+    def _write(self, meta: dict):
+        meta["modifiedTime"] = datetime.now(timezone.utc).isoformat()
+        with open(self._meta_path(meta["id"]), "w") as outfile:
+            json.dump(meta, outfile)
+        return meta
+
+    def _store(self, file_id: str, content) -> dict:
+        if isinstance(content, str):
+            shutil.copyfile(content, self._blob_path(file_id))
+        else:
+            with open(self._blob_path(file_id), "wb") as outfile, content.getbuffer() as view:
+                outfile.write(view)
+        size = os.path.getsize(self._blob_path(file_id))
+        # only the transfer time, the caller has already waited out the
+        # round-trip
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+        return {"md5Checksum": md5(self._blob_path(file_id)), "size": str(size)}
+
+    def ensure(self, file_id: str, name: str, parent: str = None, content: bytes = None):
+        # create a file or folder with a fixed id, e.g. the hardcoded Drive
+        # ids in modules.g, unless it already exists
+        if os.path.exists(self._meta_path(file_id)):
+            return
+        meta = {"id": file_id, "name": name, "parents": [
+            parent] if parent else [], "mimeType": FOLDER}
+        if content is not None:
+            meta.update(self._store(file_id, io.BytesIO(content)))
+            meta["mimeType"] = "application/octet-stream"
+        self._write(meta)
+
+    def metadata(self, file_id: str) -> dict:
+        with span("local", "metadata"):
+            self._wait()
+            return self._read(file_id)
+
+    def download(self, file_id: str, fh, progress=None):
+        with span("local", "download") as info:
+            with open(self._blob_path(file_id), "rb") as infile:
+                shutil.copyfileobj(infile, fh)
+                info["bytes"] = infile.tell()
+            self._wait(info["bytes"])
+            if progress is not None:
+                progress(1.0)
+            if fh.seekable():
+                fh.seek(0)
+            return fh
+
+    def create_folder(self, name: str, parent: str) -> str:
+        with span("local", "create_folder"):
+            self._wait()
+            return self._write({"id": uuid.uuid4().hex, "name": name, "parents": [parent], "mimeType": FOLDER})["id"]
+
+    def create_folders(self, names: list, parent: str) -> list:
+        # like a Drive batch, one round-trip for all of them
+        with span("local", "create_folders"):
+            self._wait()
+            return [self._write({"id": uuid.uuid4().hex, "name": name, "parents": [parent], "mimeType": FOLDER})["id"] for name in names]
+
+    def create_file(self, name: str, parent: str, content, mimetype: str = None, progress=None) -> dict:
+        with span("local", "create_file") as info:
+            self._wait()
+            file_id = uuid.uuid4().hex
+            meta = {"id": file_id, "name": name,
+                    "parents": [parent], "mimeType": mimetype}
+            meta.update(self._store(file_id, content))
+            info["bytes"] = int(meta["size"])
+            if progress is not None:
+                progress(1.0)
+            return self._write(meta)
+
+    def update_file(self, file_id: str, name: str, content=None, mimetype: str = None, progress=None) -> dict:
+        with span("local", "update_file") as info:
+            self._wait()
+            meta = self._read(file_id)
+            meta["name"] = name
+            if content is not None:
+                meta.update(self._store(file_id, content))
+                info["bytes"] = int(meta["size"])
+                if progress is not None:
+                    progress(1.0)
+            return self._write(meta)
+
+    def move(self, file_id: str, parent: str, previous: str = None):
+        with span("local", "move"):
+            self._wait()
+            meta = self._read(file_id)
+            meta["parents"] = [parent]
+            self._write(meta)
+
+    def delete(self, file_id: str):
+        with span("local", "delete"):
+            self._wait()
+            os.remove(self._meta_path(file_id))
+            if os.path.exists(self._blob_path(file_id)):
+                os.remove(self._blob_path(file_id))
+
+    def _all(self) -> list:
+        metas = []
+        for name in os.listdir(os.path.join(self.root, "meta")):
+            with open(os.path.join(self.root, "meta", name)) as infile:
+                metas.append(json.load(infile))
+        return metas
+
+    def children(self, parent: str) -> list:
+        with span("local", "children"):
+            self._wait()
+            return sorted([{"id": meta["id"], "name": meta["name"], "mimeType": meta.get("mimeType")}
+                           for meta in self._all() if parent in meta["parents"]], key=lambda file: file["name"])
+
+    def find(self, name: str, parent: str) -> str | None:
+        with span("local", "find"):
+            self._wait()
+            for meta in self._all():
+                if meta["name"] == name and parent in meta["parents"]:
+                    return meta["id"]
+            return None
@@ -1,42 +1,206 @@
 import datetime
+import hashlib
+import io
 import json
+import os
 import re
+import shutil
+import sys
+import threading
+import uuid
+import zipfile
+import zlib
+from collections import OrderedDict
 from io import BytesIO
 from typing import Dict, List, Optional
+from xml.etree import ElementTree
 import pyreadstat
-import docx
 import pandas as pd
-from .calculate import generateData
+from .cache import CACHE_DIR
+from .calculate import SAV_RENAMES, generateData, questionColumns, readSav, relabel, writeSav
+
+from .g import File, Folder, getLog, updateLog
+
+
+class QuestionClassifier:
+    # Question types recognised in an instrument, in priority order: the
+    # first rule that matches wins. Each rule is (pattern, keyword, type),
+    # the keyword is a lowercase literal that any match must contain, so most
+    # rules are rejected by a substring check before their regex is run.
+    RULES = [
+        (r"(^do you (plan|intend) to vote)|(\. do you (plan|intend) to vote)",
+         "to vote", "Screen"),
+        ("who would you vote for your (second|2nd) choice",
+         "choice", "2nd Choice"),
+        ("what is your opinion of", "what is your opinion of", "Image"),
+        ("how do you (plan|intend) to vote", "to vote", "Vote Method"),
+        ("knowing what you know now", "knowing what you know now", "Informed Ballot"),
+        ("who would you vote for", "who would you vote for", "Ballot"),
+        ("have you recently seen, read(|,) or heard", "recently seen", "SRH"),
+        ("see, read(|,) or hear", "see, read", "SRH Method"),
+        ("If you have recently seen, read(|,) or heard",
+         "if you have recently seen", "SRH Impact"),
+        ("is doing (his|her) job", "job", "Job Approval"),
+        ("(which|what) party do you most align with",
+         "party do you most align with", "Party"),
+        ("what is your age", "what is your age", "Age"),
+        ("(what|which) ideology is most in line with your views",
+         "ideology is most in line with your views", "Ideology"),
+        ("are you male or female", "are you male or female", "Gender"),
+        ("what is the highest level of education you have (completed|attained) so far",
+         "highest level of education", "Education"),
+        ("what is your race", "what is your race", "Race"),
+        ("which of the following candidates would you be more likely to vote for",
+         "which of the following candidates would you be more likely to vote for", "AB Test"),
+        ("does knowing this", "does knowing this", "Message"),
+    ]
+    SUB_TYPES = {
+        "Ballot": "^if the (.+) were held today",
+        "Head to Head": "^if the (.+) were held today",
+        "Image": "what is your opinion of (.+)?",
+    }
+
+    def __init__(self):
+        # compiled once, rather than on every paragraph of every instrument
+        self.rules = [(keyword, re.compile(pattern, re.IGNORECASE), q_type)
+                      for pattern, keyword, q_type in self.RULES]
+        self.sub_types = {q_type: re.compile(pattern, re.IGNORECASE)
+                          for q_type, pattern in self.SUB_TYPES.items()}
+        self.screen = re.compile(
+            "do you (plan|intend) to vote", re.IGNORECASE)
+        self.candidate_a = re.compile("Candidate A. ", re.IGNORECASE)
+        self.candidate_b = re.compile("Candidate B. ", re.IGNORECASE)
+
+    def classify(self, text: str) -> tuple:
+        # (question type, sub type) of a question's text
+        lower = text.lower()
+        for keyword, pattern, q_type in self.rules:
+            if keyword in lower and pattern.search(text):
+                return q_type, self.sub_type(q_type, text)
+        return "Generic", None
+
+    def sub_type(self, q_type: str, text: str, answers: List[str] = ()) -> str | None:
+        if q_type == "AB Test":
+            # the candidates are only known once the answers are in
+            if len(answers) < 2:
+                return None
+            a = self.candidate_a.search(answers[0])
+            b = self.candidate_b.search(answers[1])
+            return a.group(0) + b.group(0) if a and b else None
+        pattern = self.sub_types.get(q_type)
+        if pattern is None:
+            return None
+        match = pattern.search(text)
+        return (match.group(1) or "") if match else None
+
+
+classifier = QuestionClassifier()
+
+# demographics and the screener are indexed by their type instead of Q<n>
+INDEXED_BY_TYPE = {"Screen", "Ideology",
+                   "Gender", "Education", "Age", "Party", "Race"}
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# text equivalents of the non-text elements of a run, as python-docx reads them
+RUN_TEXT = {W + "tab": "\t", W + "ptab": "\t",
+            W + "cr": "\n", W + "noBreakHyphen": "-"}
+# typographic characters normalised in question and answer text, in order
+CLEANUP = [(" – ", "-"), ("’", "'"), ("“", '"'),
+           ("”", '"'), ("\r", ""), ("\n", "")]
+
+
+def _paragraph(p) -> tuple:
+    numbered, level = False, 0
+    numPr = p.find(W + "pPr/" + W + "numPr")
+    if numPr is not None and numPr.find(W + "numId") is not None:
+        numbered = True
+        ilvl = numPr.find(W + "ilvl")
+        # Word treats a missing level as the top level
+        if ilvl is not None:
+            level = int(ilvl.get(W + "val", 0))
+    text = []
+    for child in p:
+        if child.tag == W + "r":
+            runs = [child]
+        elif child.tag == W + "hyperlink":
+            runs = child.findall(W + "r")
+        else:
+            continue
+        for run in runs:
+            for e in run:
+                if e.tag == W + "t":
+                    text.append(e.text or "")
+                elif e.tag == W + "br":
+                    # page and column breaks have no text
+                    if e.get(W + "type", "textWrapping") == "textWrapping":
+                        text.append("\n")
+                elif e.tag in RUN_TEXT:
+                    text.append(RUN_TEXT[e.tag])
+    text = "".join(text)
+    for old, new in CLEANUP:
+        text = text.replace(old, new)
+    return text, numbered, level
+
+
+def docx_paragraphs(file):
+    # (text, numbered, list level) for each paragraph of the document body,
+    # streamed from word/document.xml without building the python-docx
+    # object model. Like Document.paragraphs, paragraphs inside tables are
+    # not included.
+    with zipfile.ZipFile(file) as archive, archive.open("word/document.xml") as xml:
+        depth = 0
+        for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                continue
+            depth -= 1
+            # children of w:body, which is itself a child of w:document
+            if depth == 2:
+                if element.tag == W + "p":
+                    yield _paragraph(element)
+                element.clear()
+
+NON_WORD = re.compile(r'[^\w]')
+WORD = re.compile(r'\w+')
+
+
+def normalize(text: str) -> str:
+    # question text with case, spacing and punctuation removed
+    return NON_WORD.sub('', text.lower())
 
-from .g import File, Folder, getLogs, updateLog
+
+def shingles(text: str) -> set:
+    # consecutive word pairs, a question with a single word is its own shingle
+    words = WORD.findall(text.lower())
+    if len(words) < 2:
+        return set(words)
+    return {words[i] + " " + words[i + 1] for i in range(len(words) - 1)}
+
+
+def _intern(value: str | None) -> str | None:
+    # types, sub types and indices repeat across every survey, share them
+    return sys.intern(value) if value is not None else None
 
 
 class Question:
-    def __init__(self, question: str = "Is this a question?", question_type: str = "Generic", answers: List[str] = ["Yes", "No"], index: str = "0"):
+    # slotted, with interned types and the answers as a tuple, as thousands
+    # of archived surveys may be loaded at once
+    __slots__ = ("question", "question_type", "answers", "index", "sub_type")
+
+    def __init__(self, question: str = "Is this a question?", question_type: str = "Generic", answers: List[str] = ("Yes", "No"), index: str = "0", sub_type: str = None):
         self.question = question
         if question_type == "Ballot" and len(answers) == 3:
-            self.question_type = "Head to Head"
+            question_type = "Head to Head"
         elif question_type == "Informed Ballot" and len(answers) == 3:
-            self.question_type = "Informed Head to Head"
-        else:
-            self.question_type = question_type
-        self.answers = answers
-        self.index = index
-        match self.question_type:
-            case "Ballot":
-                self.sub_type = re.findall(
-                    "^if the (.+) were held today", self.question, re.IGNORECASE)[0]
-            case "Head to Head":
-                self.sub_type = re.findall(
-                    "^if the (.+) were held today", self.question, re.IGNORECASE)[0]
-            case "Image":
-                self.sub_type = re.findall(
-                    "what is your opinion of (.+)?", self.question, re.IGNORECASE)[0]
-            case "AB Test":
-                self.sub_type = re.findall("Candidate A. ", answers[0], re.IGNORECASE)[
-                    0] + re.findall("Candidate B. ", answers[1], re.IGNORECASE)[0]
-            case _:
-                self.sub_type = None
+            question_type = "Informed Head to Head"
+        self.question_type = _intern(question_type)
+        # answer lists repeat across surveys (Yes/No, demographics...)
+        self.answers = tuple(map(sys.intern, answers))
+        self.index = _intern(index)
+        if sub_type is None:
+            sub_type = classifier.sub_type(
+                self.question_type, self.question, self.answers)
+        self.sub_type = _intern(sub_type)
 
     def __str__(self) -> str:
         return self.question + "\n" + "\n".join(self.answers) + "\n"
@@ -45,8 +209,9 @@ class Question:
         return {
             "question": self.question,
             "question_type": self.question_type,
-            "answers": self.answers,
-            "index": self.index
+            "answers": list(self.answers),
+            "index": self.index,
+            "sub_type": self.sub_type
         }
 
     def __eq__(self, __value: object) -> bool:
@@ -57,7 +222,7 @@ class Question:
         else:
             return False
 
-        if re.sub(r'[^\w]', '', self.question.lower()) == re.sub(r'[^\w]', '', other.question.lower()):
+        if normalize(self.question) == normalize(other.question):
             return True
         if self.question_type == other.question_type and self.sub_type == other.sub_type:
             return True
@@ -71,13 +236,93 @@ class Question:
 
     @classmethod
     def from_dict(cls, dict: dict):
-        return cls(dict["question"], dict["question_type"], dict["answers"], dict["index"])
+        return cls(dict["question"], dict["question_type"], dict["answers"], dict["index"], dict.get("sub_type"))
 
     # def to_shiny_module(self) -> str:
     #    return "question_ui(custom_label = \"" + self.index + "\")"
 
 
+RANDOM_ORDER = re.compile(r" \(random order\)", re.IGNORECASE)
+# answer relabels for the poll template, by question type
+RELABEL = {
+    "Race": [(re.compile("african american", re.IGNORECASE), "Black")],
+    "Ideology": [(re.compile("conservative", re.IGNORECASE), "Conserv.")],
+    "Age": [(re.compile("65 or older", re.IGNORECASE), "65+")],
+}
+# joins cells so a rule runs once over a block of columns, answers never
+# contain it
+CELL = "\x00"
+# Education answers are recoded whole rather than substituted
+HIGH_SCHOOL = re.compile("high school", re.IGNORECASE)
+GRADUATE = re.compile("grad(|uate) degree or higher", re.IGNORECASE)
+
+# recent to_dataframe results by survey fingerprint, so rebuilding the
+# template for an unchanged survey (every "Make Poll" click) is a copy
+FRAME_CACHE_SIZE = 32
+_frames = OrderedDict()
+_frames_lock = threading.Lock()
+
+
+def _ivr(question: Question, write):
+    write(question.question)
+    write("\n")
+    for i, answer in enumerate(question.answers):
+        write("For " + answer + " press "+str(i+1) + "\n")
+    write("\n")
+
+
+def _alchemer(question: Question, write):
+    write(question.question)
+    for answer in question.answers:
+        write("\n() " + answer)
+    write("\n\n")
+
+
+def _qscript(question: Question, write):
+    if question.question_type == "Screen":
+        return
+    # calls to Resources/tidy.QScript's to_page(type, answer_options,
+    # question), run after it so data_file is defined. The strings are
+    # JavaScript, json.dumps quotes and escapes them.
+    write("to_page(" + json.dumps(question.question_type) + ", " + str(len(question.answers)) +
+          ", data_file.getQuestionByName(" + json.dumps(question.index) + "));\n")
+
+
+# script formats, each writes one question to a text sink
+SCRIPTS = {"ivr": _ivr, "alchemer": _alchemer, "qscript": _qscript}
+# names of the scripts in the bundle
+SCRIPT_FILES = {"ivr": "ivr_script.txt",
+                "alchemer": "alchemer_script.txt", "qscript": "script.QScript"}
+
+
+class _Chunks(io.RawIOBase):
+    # write-only, unseekable sink that hands back what has been written to
+    # it so far
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# version of the to_bytes encoding, the first byte of every encoded survey,
+# with the COMPRESSED bit set when the rest is zlib-compressed
+SURVEY_FORMAT = 2
+COMPRESSED = 0x80
+
+
 class Survey:
+    __slots__ = ("title", "date", "n", "questions")
+
     def __init__(self, title: str, date: Optional[str], n: Optional[int], questions: list[Question]):
         self.title = title
         self.date = date
@@ -91,22 +336,11 @@ class Survey:
         return self.title + "\n" + self.date + "\n" + self.n + "\n" + string
 
     def __dict__(self) -> dict:
-        dict = {
-            "title": self.title,
-            "date": self.date,
-            "n": self.n,
-            "questions": {
-
-            }
-        }
-        for question in self.questions:
-            dict["questions"][question.index] = question.to_dict()
-
         return {
             "title": self.title,
             "date": self.date,
             "n": self.n,
-            "questions": self.questions.to_dict()
+            "questions": [question.to_dict() for question in self.questions]
         }
 
     def __len__(self) -> int:
@@ -122,9 +356,24 @@ class Survey:
     def __getitem__(self, index):
         return self.questions[index]
 
-    def to_spss_metadata(self):
-        # TODO: Create SPSS metadata
-        return self.to_column_names()["Full"]
+    def to_spss_metadata(self, labels: pd.DataFrame) -> tuple:
+        # (column labels, answer labels) by column of the combined data, from
+        # the labels generateData returned with it. Each column is labelled
+        # with its question text from the export. Columns whose text matches
+        # a question of this survey also get its answers in questionnaire
+        # order, recoded the way generateData recodes the data.
+        index = QuestionIndex(self.questions)
+        column_labels = {}
+        answer_labels = {}
+        for column, text in questionColumns(labels).items():
+            column_labels[column] = text
+            matches = index.similar(Question(text, "Generic", (), column))
+            if not matches:
+                continue
+            answers = [relabel(column, RANDOM_ORDER.sub("", answer).strip())
+                       for answer in matches[0][0].answers]
+            answer_labels[column] = list(dict.fromkeys(answers))
+        return column_labels, answer_labels
 
     @classmethod
     def from_dict(cls, dict: dict):
@@ -134,111 +383,176 @@ class Survey:
         return cls(dict["title"], dict["date"], dict["n"], questions)
 
     @classmethod
-    def from_docx(cls, file: File):
+    def from_sav(cls, path: str, meta=None):
+        # The questions of a past poll from its SPSS metadata (read from
+        # `path` unless given): the variable labels as question text (the
+        # name when unlabelled), the value labels in code order as answers
+        # and the variable name as index.
+        if meta is None:
+            _, meta = pyreadstat.read_sav(path, metadataonly=True)
+        questions = []
+        for column in meta.column_names:
+            if column in SAV_RENAMES or column == "ID":
+                continue
+            text = meta.column_names_to_labels.get(column) or column
+            labels = meta.variable_value_labels.get(column, {})
+            q_type, sub_type = classifier.classify(text)
+            questions.append(Question(text, q_type, [labels[code] for code in sorted(labels)],
+                                      column, sub_type))
+        return cls(meta.file_label or os.path.basename(path), "DATE", str(meta.number_rows), questions)
+
+    def to_bytes(self, compress: bool = False) -> bytes:
+        # JSON with one positional array per question, smaller and faster to
+        # load than to_dict. Compressing takes it to about a third of the size
+        # but decompressing costs more than it saves when loading, so it is
+        # only worth it for surveys that are stored rather than reloaded.
+        payload = json.dumps([self.title, self.date, self.n, [
+            [q.question, q.question_type, q.answers, q.index, q.sub_type] for q in self.questions]],
+            separators=(",", ":")).encode()
+        if compress:
+            return bytes([SURVEY_FORMAT | COMPRESSED]) + zlib.compress(payload)
+        return bytes([SURVEY_FORMAT]) + payload
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        # anything that isn't a whole encoded survey is a ValueError
+        if not data:
+            raise ValueError("Empty survey data")
+        if data[0] & ~COMPRESSED != SURVEY_FORMAT:
+            raise ValueError("Unknown survey format: " + str(data[0]))
+        payload = memoryview(data)[1:]
+        if data[0] & COMPRESSED:
+            payload = zlib.decompress(payload)
+        title, date, n, encoded = json.loads(bytes(payload))
+        # questions are restored exactly as they were encoded, without
+        # going through __init__ to re-derive their types
+        questions = []
+        new = Question.__new__
+        for text, question_type, answers, index, sub_type in encoded:
+            question = new(Question)
+            question.question = text
+            question.question_type = sys.intern(question_type)
+            question.answers = tuple(map(sys.intern, answers))
+            question.index = sys.intern(index)
+            question.sub_type = _intern(sub_type)
+            questions.append(question)
+        return cls(title, date, n, questions)
+
+    @classmethod
+    def from_docx(cls, file: File | BytesIO | bytes):
         if file is None:
             print("Docx file not provided")
             return None
+        if isinstance(file, File):
+            file = file()
+        elif isinstance(file, bytes):
+            file = BytesIO(file)
+        # the same instrument is only ever parsed once
+        digest = hashlib.file_digest(file, "md5").hexdigest()
+        survey = survey_cache.get(digest)
+        if survey is not None:
+            return survey
+        file.seek(0)
         print("\n"*5)
         print("Creating survey from docx")
         print("\n"*5)
 
-        doc = docx.Document(file())
+        survey = cls.from_paragraphs(docx_paragraphs(file))
+        survey_cache.put(digest, survey)
+        return survey
+
+    @classmethod
+    def from_paragraphs(cls, paragraphs):
+        # paragraphs are (text, numbered, list level), see docx_paragraphs.
+        # Answers are collected first so each Question is built once, from
+        # its complete answer list.
         questions = []
-        for para in doc.paragraphs:
-            para.text = re.sub(" – ", "-", para.text)
-            para.text = re.sub("’", "'", para.text)
-            para.text = re.sub("“", '"', para.text)
-            para.text = re.sub("”", '"', para.text)
-            para.text = re.sub("\n", "", para.text)
-
-            if para._element.get_or_add_pPr().get_or_add_numPr().numId is not None:
-                if para._element.get_or_add_pPr().get_or_add_numPr().get_or_add_ilvl().val == 0:
-                    match RegexMatch(para.text):
-                        case "(^do you (plan|intend) to vote)|(\. do you (plan|intend) to vote)":
-                            q_type = "Screen"
-                        case "who would you vote for your (second|2nd) choice":
-                            q_type = "2nd Choice"
-                        case "what is your opinion of":
-                            q_type = "Image"
-                        case "how do you (plan|intend) to vote":
-                            q_type = "Vote Method"
-                        case "knowing what you know now":
-                            q_type = "Informed Ballot"
-                        case "who would you vote for":
-                            q_type = "Ballot"
-                        case "have you recently seen, read(|,) or heard":
-                            q_type = "SRH"
-                        case "see, read(|,) or hear":
-                            q_type = "SRH Method"
-                        case "If you have recently seen, read(|,) or heard":
-                            q_type = "SRH Impact"
-                        case "is doing (his|her) job":
-                            q_type = "Job Approval"
-                        case "(which|what) party do you most align with":
-                            q_type = "Party"
-                        case "what is your age":
-                            q_type = "Age"
-                        case "(what|which) ideology is most in line with your views":
-                            q_type = "Ideology"
-                        case "are you male or female":
-                            q_type = "Gender"
-                        case "what is the highest level of education you have (completed|attained) so far":
-                            q_type = "Education"
-                        case "what is your race":
-                            q_type = "Race"
-                        case "which of the following candidates would you be more likely to vote for":
-                            q_type = "AB Test"
-                        case "does knowing this":
-                            q_type = "Message"
-
-                        case _:
-                            q_type = "Generic"
-                    if re.search("Screen|Ideology|Gender|Education|Age|Party|Race", q_type):
+        for text, numbered, level in paragraphs:
+            if numbered:
+                if level == 0:
+                    q_type, sub_type = classifier.classify(text)
+                    if q_type in INDEXED_BY_TYPE:
                         index = q_type
                     else:
                         index = "Q"+str(len(questions))
-                    questions.append(Question(para.text, q_type, [], index))
-                elif para._element.get_or_add_pPr().get_or_add_numPr().get_or_add_ilvl().val == 1:
-                    questions[-1].answers.append(para.text)
-            elif re.search("do you (plan|intend) to vote", para.text, flags=re.IGNORECASE):
-                questions.append(Question(para.text, "Screen", [], "Screen"))
-        return cls("TITLE", "DATE", "N", questions)
+                    questions.append((text, q_type, [], index, sub_type))
+                elif level == 1:
+                    questions[-1][2].append(text)
+            elif classifier.screen.search(text):
+                questions.append((text, "Screen", [], "Screen", None))
+        return cls("TITLE", "DATE", "N", [Question(*question) for question in questions])
+
+    def fingerprint(self) -> str:
+        # changes whenever anything to_dataframe depends on changes
+        return hashlib.md5(json.dumps([(question.index, question.question_type, question.answers)
+                                       for question in self.questions]).encode()).hexdigest()
 
     def to_dataframe(self, as_bytes=True) -> pd.DataFrame:
-        df = pd.DataFrame()
+        fingerprint = self.fingerprint()
+        with _frames_lock:
+            df = _frames.get(fingerprint)
+            if df is not None:
+                _frames.move_to_end(fingerprint)
+        if df is None:
+            df = self._build_dataframe()
+            with _frames_lock:
+                _frames[fingerprint] = df
+                while len(_frames) > FRAME_CACHE_SIZE:
+                    _frames.popitem(last=False)
+        print(as_bytes)
+        # callers may modify their copy
+        return df.copy()
+
+    def _answer_columns(self, rows: int) -> dict:
+        # every question's answers, padded to `rows` and relabelled as plain
+        # lists, each rule being one substitution over all the cells of the
+        # columns it applies to
+        columns = {}
+        types = {}
         for question in self.questions:
-            fill = [""] * (10-len(question.answers))
-            df[question.index] = question.answers + fill
-            df[question.index] = df[question.index].transform(
-                lambda x: re.sub(" \(random order\)", "", str(x), flags=re.IGNORECASE))
-            match question.question_type:
-                case "Race":
-                    df[question.index] = df[question.index].transform(
-                        lambda x: re.sub("african american", "Black", str(x), flags=re.IGNORECASE))
-                case "Ideology":
-                    df[question.index] = df[question.index].transform(
-                        lambda x: re.sub("conservative", "Conserv.", str(x), flags=re.IGNORECASE))
-                case "Education":
-                    df[question.index] = df[question.index].transform(
-                        lambda x:
-                        "HS" if re.search("high school", str(x), flags=re.IGNORECASE) else "Grad+" if re.search("grad(|uate) degree or higher", str(x), flags=re.IGNORECASE) else str(x))
-                case "Age":
-                    df[question.index] = df[question.index].transform(
-                        lambda x: re.sub("65 or older", "65+", str(x), flags=re.IGNORECASE))
+            columns[question.index] = [str(answer) for answer in question.answers] + \
+                [""] * (rows - len(question.answers))
+            types[question.index] = question.question_type
+
+        def substitute(keys, pattern, label):
+            cells = pattern.sub(label, CELL.join(
+                CELL.join(columns[key]) for key in keys)).split(CELL)
+            for i, key in enumerate(keys):
+                columns[key] = cells[i * rows:(i + 1) * rows]
+
+        if columns:
+            substitute(list(columns), RANDOM_ORDER, "")
+        for q_type, rules in RELABEL.items():
+            keys = [key for key in columns if types[key] == q_type]
+            for pattern, label in rules if keys else []:
+                substitute(keys, pattern, label)
+        for key in columns:
+            if types[key] == "Education":
+                columns[key] = ["HS" if HIGH_SCHOOL.search(answer) else "Grad+" if GRADUATE.search(answer) else answer
+                                for answer in columns[key]]
+        return columns
+
+    def _build_dataframe(self) -> pd.DataFrame:
+        # the answer columns are built in one allocation
+        rows = max([10] + [len(question.answers)
+                   for question in self.questions])
+        df = pd.DataFrame(self._answer_columns(rows))
+
+        def pad(values):
+            return values + [""] * (rows - len(values))
 
         df["X1"] = df["Gender"]
         df["X2"] = df["Education"]
         df["X3"] = df["Ideology"]
         df["X4"] = df["Age"]
         df["X5"] = df["Race"]
-        df["X6"] = [1, 2, 3, 4, 0] + [""] * 5
+        df["X6"] = pad([1, 2, 3, 4, 0])
         if "Party" in df.columns:
             df["X7"] = df["Party"]
         else:
-            df["X7"] = [""] * 10
-        df["X8"] = ["DMA1", "DMA2", "DMA3", "DMA4", "DMA5"] + [""] * 5
-        df["X9"] = ["CD1", "CD2", "CD3", "CD4", "CD5"] + [""] * 5
-        print(as_bytes)
+            df["X7"] = pad([])
+        df["X8"] = pad(["DMA1", "DMA2", "DMA3", "DMA4", "DMA5"])
+        df["X9"] = pad(["CD1", "CD2", "CD3", "CD4", "CD5"])
         return df
 
     def to_column_names(self, as_bytes: bool = False) -> pd.DataFrame:
@@ -276,43 +590,212 @@ class Survey:
             "xLabel": ["Gender", "Education Level", "Ideology", "Age", "Race", "Last 4 Generals", "Party", "DMA", "CD"]
         })
 
-    def to_ivr_script(self) -> str:
-        string = ""
+    def write_scripts(self, sinks: dict):
+        # sinks maps script formats (see SCRIPTS) to text sinks, anything
+        # with a write(str) method: an open file, a StringIO, a
+        # TextIOWrapper around a response. Every format is written in the
+        # same pass over the questions.
+        writers = [(SCRIPTS[name], sink.write) for name, sink in sinks.items()]
         for question in self.questions:
-            string += question.question
-            string += "\n"
-            for i, answer in enumerate(question.answers):
-                string += "For " + answer + " press "+str(i+1) + "\n"
-            string += "\n"
-        return string
+            for script, write in writers:
+                script(question, write)
+
+    def _script(self, name: str) -> str:
+        sink = io.StringIO()
+        self.write_scripts({name: sink})
+        return sink.getvalue()
+
+    def to_ivr_script(self) -> str:
+        return self._script("ivr")
 
     def to_alchemer_script(self) -> str:
-        string = ""
-        for question in self.questions:
-            string += question.question
-            for answer in question.answers:
-                string += "\n() " + answer
-            string += "\n\n"
-        return string
+        return self._script("alchemer")
 
     def to_qscript(self) -> str:
-        string = ""
-        for question in self.questions:
-            if question.question_type == "Screen":
-                continue
-            string += "toPage(" + question.type + ", " + \
-                str(len(question.answers)) + ", " + question.index + ")\n"
-        return string
+        return self._script("qscript")
+
+    def iter_bundle(self):
+        # A zip of every artifact for the poll (the scripts, the template
+        # data, column names and xnames), yielded in chunks as each entry is
+        # written so it can be streamed straight to a download.
+        sink = _Chunks()
+        scripts = {name: io.StringIO() for name in SCRIPTS}
+        self.write_scripts(scripts)
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as bundle:
+            for name, script in scripts.items():
+                bundle.writestr(SCRIPT_FILES[name], script.getvalue())
+                yield sink.drain()
+            for name, df in [("data.csv", self.to_dataframe()), ("xnames.csv", self.to_xnames())]:
+                with bundle.open(name, "w") as entry, io.TextIOWrapper(entry, encoding="utf-8", newline="") as text:
+                    df.to_csv(text, index=False)
+                yield sink.drain()
+            bundle.writestr("column_names.csv",
+                            self.to_column_names().getvalue())
+        yield sink.drain()
+
+    def write_bundle(self, fh):
+        # fh is any binary sink, it doesn't need to be seekable
+        for chunk in self.iter_bundle():
+            fh.write(chunk)
 
     def match_questions(self, other) -> list:
+        # other is a Survey or a QuestionIndex over any number of surveys,
+        # pairs come out in the same order as comparing every question of
+        # this survey with every question of the other
+        if not isinstance(other, QuestionIndex):
+            other = QuestionIndex(other.questions)
         q_match = []
         for question in self.questions:
-            for other_question in other.questions:
-                if other_question == question:
-                    q_match.append((question, other_question))
+            for other_question in other.exact(question):
+                q_match.append((question, other_question))
         return q_match
 
 
+class QuestionIndex:
+    # Questions from any number of surveys, indexed so a question can be
+    # matched without comparing it to every other one. Exact matches (the
+    # same rules as Question.__eq__: identical normalised text, or the same
+    # type and sub type) are hash lookups. Near-duplicate wording is found
+    # through an inverted index of word-pair shingles and scored by Jaccard
+    # similarity.
+    def __init__(self, questions: List[Question] = (), threshold: float = 0.5):
+        self.threshold = threshold
+        self.questions = []
+        self._sources = []
+        self._shingles = []
+        self._by_text = {}
+        self._by_type = {}
+        self._by_shingle = {}
+        for question in questions:
+            self.add(question)
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def add(self, question: Question, source=None):
+        # source is whatever identifies where the question came from, e.g.
+        # the project name
+        position = len(self.questions)
+        self.questions.append(question)
+        self._sources.append(source)
+        self._by_text.setdefault(
+            normalize(question.question), []).append(position)
+        self._by_type.setdefault(
+            (question.question_type, question.sub_type), []).append(position)
+        keys = shingles(question.question)
+        self._shingles.append(len(keys))
+        for key in keys:
+            self._by_shingle.setdefault(key, []).append(position)
+
+    def add_survey(self, survey: Survey, source=None):
+        for question in survey.questions:
+            self.add(question, source)
+
+    def _exact(self, question: Question) -> list:
+        by_text = self._by_text.get(normalize(question.question), [])
+        by_type = self._by_type.get(
+            (question.question_type, question.sub_type), [])
+        if not by_text:
+            return by_type
+        if not by_type:
+            return by_text
+        return sorted(set(by_text).union(by_type))
+
+    def exact(self, question: Question) -> List[Question]:
+        # in the order they were added
+        return [self.questions[position] for position in self._exact(question)]
+
+    def similar(self, question: Question, threshold: float = None) -> list:
+        # (question, source, similarity) for every indexed question whose
+        # wording overlaps at least `threshold`, most similar first
+        if threshold is None:
+            threshold = self.threshold
+        keys = shingles(question.question)
+        if not keys:
+            return []
+        shared = {}
+        for key in keys:
+            for position in self._by_shingle.get(key, ()):
+                shared[position] = shared.get(position, 0) + 1
+        matches = []
+        for position, count in shared.items():
+            score = count / (len(keys) + self._shingles[position] - count)
+            if score >= threshold:
+                matches.append((score, position))
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return [(self.questions[position], self._sources[position], score) for score, position in matches]
+
+
+# bump whenever a change to docx_paragraphs, the classifier or Question
+# would parse the same instrument differently, so old cache entries are
+# ignored rather than served
+PARSER_VERSION = 2
+
+
+class SurveyCache:
+    # Parsed instruments keyed by the .docx content hash and PARSER_VERSION,
+    # kept in memory and on disk under .cache/surveys in the Survey.to_bytes
+    # encoding, so reopening a project, switching between projects or
+    # restarting the app doesn't parse the same instrument again.
+    def __init__(self, directory: str = os.path.join(CACHE_DIR, "surveys")):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(digest: str) -> str:
+        return "%s-v%d" % (digest, PARSER_VERSION)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".bin")
+
+    def get(self, digest: str) -> Survey | None:
+        key = self.key(digest)
+        with self._lock:
+            entry = self._entries.get(key)
+        try:
+            if entry is None:
+                with open(self._path(key), "rb") as infile:
+                    entry = infile.read()
+            # a new Survey each time, callers are free to modify theirs
+            survey = Survey.from_bytes(entry)
+        except (FileNotFoundError, ValueError, zlib.error):
+            self.misses += 1
+            return None
+        with self._lock:
+            self._entries[key] = entry
+        self.hits += 1
+        return survey
+
+    def put(self, digest: str, survey: Survey):
+        key = self.key(digest)
+        entry = survey.to_bytes()
+        with self._lock:
+            self._entries[key] = entry
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(key) + "." + uuid.uuid4().hex + ".tmp"
+        with open(tmp, "wb") as outfile:
+            outfile.write(entry)
+        os.replace(tmp, self._path(key))
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+
+survey_cache = SurveyCache()
+
+
 class ContactSet(Folder):
     driveID: str = None
     combined: File = None
@@ -364,12 +847,10 @@ class ContactSet(Folder):
 
     @classmethod
     def from_dict(cls, contact: dict):
-
-        if "driveID" in contact.keys():
-            cs = cls([], parent=contact["parent"] if "parent" in contact.keys()
-                     else None, driveID=contact["driveID"])
-        else:
-            KeyError("Contact Set does not have a driveID")
+        # pure deserialization, every folder and file already exists on Drive
+        if "driveID" not in contact.keys():
+            raise KeyError("Contact Set does not have a driveID")
+        cs = cls([], parent=contact.get("parent"), driveID=contact["driveID"])
         if "combined" in contact.keys():
             cs.combined = File.from_dict(contact["combined"])
         if "cells" in contact.keys():
@@ -378,13 +859,14 @@ class ContactSet(Folder):
             cs.landlines = File.from_dict(contact["landlines"])
         for key in contact.keys():
             if key not in ["driveID", "combined", "cells", "landlines", "parent", "name"]:
-                cs.raw.append(File.from_dict(contact[key]))
+                file = File.from_dict(contact[key])
                 if re.search("^X_[A-Z0-9]{9}", key):
-                    cs.l2_files.append(File.from_dict(contact[key]))
+                    cs.l2_files.append(file)
                 elif re.search("-[a-z0-9]{32}.csv", key):
-                    cs.i360_files.append(File.from_dict(contact[key]))
+                    cs.i360_files.append(file)
                 else:
-                    cs.misc.append(File.from_dict(contact[key]))
+                    cs.misc.append(file)
+        cs.raw = cs.l2_files + cs.i360_files + cs.misc
         return cs
 
     # write a generator to iterate through all the files in the contact set
@@ -427,15 +909,19 @@ class ContactSet(Folder):
                 self.misc.append(file)
             self.raw.append(file)
 
-    def get(self, name: str, bytes: bool = False):
+    def get(self, name: str, bytes: bool = False, chunksize: int = None):
         if name == "cells":
-            file = self.cells()
+            file = self.cells
         elif name == "landlines":
-            file = self.landlines()
+            file = self.landlines
         elif name == "combined":
-            file = self.combined()
+            file = self.combined
         else:
             return None
+        if chunksize is not None:
+            # iterate DataFrame chunks while the list is still downloading
+            return file.iter_csv(chunksize)
+        file = file()
         if bytes:
             return file
         else:
@@ -453,18 +939,27 @@ class DataSet(Folder):
     column_output: File = None
     xnames_output: File = None
 
-    def __init__(self, name: str, parent: str = None):
-        super().__init__(name, parent=parent)
-        self.supporting_documents = Folder(
-            "Supporting Documents", parent=self.driveID)
-        self.input_files = Folder("Input Files", parent=self.driveID)
+    def __init__(self, name: str, parent: str = None, driveID: str = None, supporting_documents: Folder = None, input_files: Folder = None):
+        super().__init__(name, driveID=driveID, parent=parent)
+        self.files = []
+        if supporting_documents is None and input_files is None:
+            supporting_documents, input_files = Folder.create_many(
+                ["Supporting Documents", "Input Files"], parent=self.driveID)
+        if supporting_documents is None:
+            supporting_documents = Folder(
+                "Supporting Documents", parent=self.driveID)
+        self.supporting_documents = supporting_documents
+        if input_files is None:
+            input_files = Folder("Input Files", parent=self.driveID)
+        self.input_files = input_files
         self.name = name
 
     def __dict__(self):
         dict = {
             "name": self.name,
             "driveID": self.driveID,
-            "files": self.files,
+            "parent": self.parent,
+            "files": [file.to_dict() for file in self.files],
             "supporting_documents": self.supporting_documents.to_dict(),
             "input_files": self.input_files.to_dict(),
         }
@@ -540,16 +1035,16 @@ class DataSet(Folder):
 
     @classmethod
     def from_dict(cls, dict: dict):
-        dataset = cls(dict["name"])
-        dataset.driveID = dict["driveID"]
-        dataset.files = dict["files"]
-        dict["supporting_documents"]["name"] = "Supporting Documents"
-        dict["supporting_documents"]["parent"] = dict["driveID"]
-        dataset.supporting_documents = Folder.from_dict(
-            dict["supporting_documents"])
-        dict["input_files"]["name"] = "Input Files"
-        dict["input_files"]["parent"] = dict["driveID"]
-        dataset.input_files = Folder.from_dict(dict["input_files"])
+        # pure deserialization, the version folders already exist on Drive so
+        # pass their IDs in rather than letting __init__ create new ones
+        supporting_documents = Folder.from_dict(
+            {**dict["supporting_documents"], "name": "Supporting Documents", "parent": dict["driveID"]})
+        input_files = Folder.from_dict(
+            {**dict["input_files"], "name": "Input Files", "parent": dict["driveID"]})
+        dataset = cls(dict["name"], parent=dict.get("parent"), driveID=dict["driveID"],
+                      supporting_documents=supporting_documents, input_files=input_files)
+        dataset.files = [File.from_dict(file)
+                         for file in dict.get("files") or []]
         if "alchemer_input" in dict.keys():
             dataset.alchemer_input = File.from_dict(dict["alchemer_input"])
         if "broadnet_input" in dict.keys():
@@ -569,6 +1064,24 @@ class DataSet(Folder):
             yield file
 
 
+def _sav_column(question: Question, index: QuestionIndex, by_column: dict, meta) -> str | None:
+    # The variable of an archived poll holding `question`. By name first,
+    # that's how to_spss names them, unless the variable's label says it is
+    # a different question. Then the same wording or, other than for
+    # Generic questions, the same type, and last the closest wording.
+    matches = index.similar(question)
+    same = by_column.get(question.index)
+    if same is not None and (meta.column_names_to_labels.get(same.index) is None or
+                             any(match is same for match, _, _ in matches)):
+        return same.index
+    for match in index.exact(question):
+        if match.question_type != "Generic" or normalize(match.question) == normalize(question.question):
+            return match.index
+    if matches:
+        return matches[0][0].index
+    return None
+
+
 class Project:
     name: str = None
     folder: Folder = None
@@ -577,12 +1090,13 @@ class Project:
     contact_lists: ContactSet = None
     versions: Dict[str, DataSet] = None
 
-    def __init__(self, name: str, survey: Optional[Survey | BytesIO] = None, contacts: Optional[ContactSet] = None, versions: Optional[Dict[str, DataSet]] = None, log: dict = getLogs()):
-        # if log is not None:
-        if name in log.keys():
+    def __init__(self, name: str, survey: Optional[Survey | BytesIO] = None, contacts: Optional[ContactSet] = None, versions: Optional[Dict[str, DataSet]] = None, log: dict = None):
+        # only this project's log is read, not every project's history
+        existing = getLog(name) if log is None else log.get(name)
+        if existing is not None:
             print("Project exists, loading from log")
-            print(json.dumps(log[name], indent=4))
-            self.from_dict(log[name])
+            print(json.dumps(existing, indent=4))
+            self.from_dict(existing)
         else:
             # Project does not exist, create new project
             print("Project does not exist, creating new project")
@@ -592,7 +1106,8 @@ class Project:
             if contacts is not None:
                 self.contact_lists = contacts
             else:
-                self.contact_lists = ContactSet([])
+                self.contact_lists = ContactSet(
+                    [], parent=self.folder.driveID)
             if versions is not None:
                 self.versions = versions
             else:
@@ -681,24 +1196,68 @@ class Project:
         self.sync(None)
         return None
 
-    def combine_data(self):
-        # TODO: Combine data files into one dataframe
-        df = pd.DataFrame()
-        lf, df = generateData(self.data, self.contact_lists[0])
+    def _generate(self) -> tuple:
+        # labels and combined responses of the latest version, from its
+        # Alchemer and Broadnet exports and the combined contact list
+        if not self.versions:
+            raise ValueError("Project " + self.name + " has no versions")
+        version = self.versions[-1]
+        if version.alchemer_input is None or version.broadnet_input is None:
+            raise ValueError("Version " + version.name +
+                             " is missing its Alchemer or Broadnet export")
+        if self.contact_lists is None or self.contact_lists.combined is None:
+            raise ValueError("Project " + self.name +
+                             " has no combined contact list")
+        return generateData([version.alchemer_input(), version.broadnet_input()], self.contact_lists.combined())
+
+    def combine_data(self) -> pd.DataFrame:
+        labels, df = self._generate()
         return df
 
-    def to_spss(self):
-        # TODO: Combine data files into one dataframe and export to SPSS
-        meta = self.survey.to_spss_metadata()
-        df = self.combine_data()
+    def to_spss(self, path: str = None, compress: bool = False) -> str:
+        # written straight from the combined data, no intermediate csv.
+        # compress writes a zlib-compressed .zsav
+        labels, df = self._generate()
+        column_labels, answer_labels = self.get_survey().to_spss_metadata(labels)
         # make sure column names don't have spaces
         df.columns = df.columns.str.replace(" ", "_")
-        df.to_csv(self.name+".csv", index=False)
-        # export to SPSS using pyreadstat
-        pyreadstat.write_sav(df, self.name+".sav", )
+        column_labels = {column.replace(" ", "_"): label
+                         for column, label in column_labels.items()}
+        answer_labels = {column.replace(" ", "_"): answers
+                         for column, answers in answer_labels.items()}
+        if path is None:
+            path = self.name + (".zsav" if compress else ".sav")
+        writeSav(df, path, column_labels, answer_labels, compress)
+        return path
+
+    def read_spss(self, path: str, questions: List[Question | str] = None, chunksize: int = 100000, multiprocess: bool = False):
+        # (labels, data) chunks of a past poll's .sav, for comparing trends
+        # with this project. Only the variables for `questions` are read:
+        # column names are taken as is, Questions (by default every question
+        # of this project's survey) are matched to the file's variables, see
+        # _sav_column.
+        _, meta = pyreadstat.read_sav(path, metadataonly=True)
+        archived = Survey.from_sav(path, meta)
+        index = QuestionIndex(archived.questions)
+        by_column = {question.index: question for question in archived}
+        if questions is None:
+            questions = self.get_survey().questions
+        columns = [column for column in meta.column_names
+                   if column in SAV_RENAMES or column == "ID"]
+        for question in questions:
+            if isinstance(question, str):
+                column = question
+            else:
+                column = _sav_column(question, index, by_column, meta)
+                if column is None:
+                    print("No match for " + question.index + " in " + path)
+                    continue
+            if column not in columns:
+                columns.append(column)
+        yield from readSav(path, columns, chunksize, multiprocess)
 
     def to_displayr_inputs(self) -> tuple:
-        labels, data = generateData(self.data, self.contact_lists[0])
+        labels, data = self._generate()
         return data, labels
 
     def new_version(self):
@@ -722,17 +1281,10 @@ class Project:
                 self.versions.append(DataSet.from_dict(dict[key]))
 
     def sync(self, log: dict):
-        print("Syncing project")
-        print(self.to_dict())
-        updateLog(self.to_dict(), log) if log is not None else updateLog(
-            self.to_dict())
+        print("Syncing project " + self.name)
+        updateLog(self.to_dict(), log)
 
     def get_survey(self) -> Survey:
         if self.survey is None:
             self._make_survey()
         return self.survey
-
-
-class RegexMatch(str):
-    def __eq__(self, pattern: str) -> bool:
-        return bool(re.search(pattern, self, flags=re.IGNORECASE))
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import tempfile
+from modules.index import DriveIndex
+
+
+class Request:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+
+class Files:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def list(self, pageToken=None, **kwargs):
+        return Request(self.pages[pageToken])
+
+
+class Changes:
+    def __init__(self, start, pages):
+        self.start = start
+        self.pages = pages
+        self.requested = []
+
+    def getStartPageToken(self, **kwargs):
+        return Request({"startPageToken": self.start})
+
+    def list(self, pageToken, fields, **kwargs):
+        assert "changeType" in fields
+        self.requested.append(pageToken)
+        return Request(self.pages[pageToken])
+
+
+class Service:
+    # the parts of the Drive client DriveIndex uses, answering from canned
+    # pages keyed by page token
+    def __init__(self, files, start, changes):
+        self._files = Files(files)
+        self._changes = Changes(start, changes)
+
+    def files(self):
+        return self._files
+
+    def changes(self):
+        return self._changes
+
+
+def folder(id, name, parent):
+    return {"id": id, "name": name, "parents": [parent], "mimeType": "application/vnd.google-apps.folder"}
+
+
+def index(files, changes, start="1"):
+    path = os.path.join(tempfile.mkdtemp(), "index.sqlite")
+    service = Service(files, start, changes)
+    return DriveIndex(path, "drive", service, lambda request: request.execute(), poll_interval=0), service
+
+
+def test_bootstrap_reads_every_page():
+    drive, _ = index({
+        None: {"files": [folder("2023", "2023", "drive")], "nextPageToken": "p2"},
+        "p2": {"files": [folder("logs", "Project Logs", "drive"), folder("a", "Poll A", "2023")]},
+    }, {"1": {"changes": [], "newStartPageToken": "1"}})
+    drive.bootstrap()
+    assert drive.find("Project Logs", "drive") == "logs"
+    assert [child["id"] for child in drive.children("2023")] == ["a"]
+    assert drive._token() == "1"
+
+
+def test_changes_are_applied():
+    drive, service = index({None: {"files": [folder("a", "Poll A", "drive"), folder("b", "Poll B", "drive")]}}, {
+        "1": {"changes": [
+            {"changeType": "file", "fileId": "c", "file": folder("c", "Poll C", "drive")},
+            {"changeType": "file", "fileId": "a", "file": folder("a", "Poll A2", "drive")},
+        ], "nextPageToken": "2"},
+        "2": {"changes": [
+            {"changeType": "file", "fileId": "b", "removed": True},
+            # the shared drive itself changed, there is no file
+            {"changeType": "drive", "driveId": "drive"},
+        ], "newStartPageToken": "3"},
+        "3": {"changes": [], "newStartPageToken": "3"},
+    })
+    drive.bootstrap()
+    drive.refresh(force=True)
+    assert [child["name"] for child in drive.children("drive")] == ["Poll A2", "Poll C"]
+    assert drive.find("Poll B", "drive") is None
+    assert drive._token() == "3"
+    assert service.changes().requested[:2] == ["1", "2"]
+
+
+def test_writes_are_not_held_across_requests():
+    drive, _ = index({None: {"files": [folder("a", "Poll A", "drive")]}},
+                     {"1": {"changes": [], "newStartPageToken": "1"}})
+    drive.bootstrap()
+    other = sqlite3.connect(drive.path, timeout=0)
+
+    def execute(request):
+        # another worker writing while this one waits on Drive
+        other.execute("INSERT OR REPLACE INTO meta VALUES ('probe', 'x')")
+        other.commit()
+        return request.execute()
+
+    drive.execute = execute
+    drive.bootstrap()
+    drive.refresh(force=True)